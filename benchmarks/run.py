@@ -0,0 +1,306 @@
+"""Offline benchmarks for the snapshot and recording pipelines.
+
+Runs without a running Home Assistant instance:
+
+    python benchmarks/run.py                                  # all suites
+    python benchmarks/run.py --suite snapshot --resolutions 1080p --iterations 50
+    python benchmarks/run.py --save baseline.json             # store a baseline
+    python benchmarks/run.py --baseline baseline.json         # compare, exit 1 on regressions
+
+The snapshot suite feeds synthetic JPEG frames into process_snapshot. The
+record suite needs ffmpeg and ffprobe: it renders an ffmpeg testsrc2 clip
+once and plays it in real time into a named pipe that stands in for the
+camera stream, then calls the record_video handler.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from custom_components.advanced_snapshot import (  # noqa: E402
+    DOMAIN, SERVICE_SCHEMA, SERVICE_SCHEMA_RECORD_VIDEO, build_snapshot_options, handle_record_video,
+    process_snapshot
+)
+from custom_components.advanced_snapshot import ingest  # noqa: E402
+from custom_components.advanced_snapshot.metrics import percentile  # noqa: E402
+import custom_components.advanced_snapshot as integration  # noqa: E402
+
+FONT_FOLDER = os.path.join(ROOT, "custom_components", "advanced_snapshot", "fonts")
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+SNAPSHOT_CASES = {
+    "plain": {},
+    "rotate_90": {"rotate_angle": 90},
+    "rotate_10": {"rotate_angle": 10},
+    "crop": {"crop": [100, 50, 640, 360]},
+    "crop_aspect": {"crop": [100, 50, 800], "crop_aspect_ratio": "16:9"},
+    "bar": {"add_bar": True, "custom_text_left": "Front door", "custom_text_right": "01.01.26 12:00:00"},
+    "max_size": {"max_size": [640, 360]},
+    "all": {
+        "rotate_angle": 10, "crop": [100, 50, 800], "crop_aspect_ratio": "16:9",
+        "add_bar": True, "custom_text_left": "Front door", "custom_text_middle": "21.5 °C",
+        "custom_text_right": "01.01.26 12:00:00",
+    },
+}
+
+RECORD_CASES = {
+    "passthrough": {},
+    "encode_bar": {"add_bar": True, "custom_text_left": "Front door", "custom_text_right": "01.01.26 12:00:00"},
+    "encode_rotate_crop": {"rotate_angle": 90, "crop": [0, 0, 540, 540]},
+}
+
+
+def synthetic_jpeg(width: int, height: int, seed: int = 0) -> bytes:
+    """A reproducible camera-like frame: smooth gradients with sensor noise."""
+    rng = random.Random(seed)
+    gradient = Image.merge("RGB", (
+        Image.linear_gradient("L").resize((width, height)),
+        Image.radial_gradient("L").resize((width, height)),
+        Image.linear_gradient("L").rotate(90).resize((width, height)),
+    ))
+    noise = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+    frame = Image.blend(gradient, noise, 0.15)
+    buffer = BytesIO()
+    frame.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def snapshot_options(data: dict) -> dict:
+    """Build the process_snapshot options with the integration's own option handling."""
+    # build_snapshot_options only needs the font folder from hass
+    hass = SimpleNamespace(data={DOMAIN: {"font_folder": FONT_FOLDER}})
+    # The schema default points into /config, the bundled font of the same name is used instead
+    return build_snapshot_options(hass, {**data, "setting_font_path": os.path.basename(data["setting_font_path"])})
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(latencies: list, wall_time: float, **extra) -> dict:
+    values = sorted(latencies)
+    return {
+        "iterations": len(values),
+        "throughput": round(len(values) / wall_time, 2) if wall_time else None,
+        "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+        "peak_rss_mb": peak_rss_mb(),
+        **extra,
+    }
+
+
+def run_snapshot_suite(resolutions: list, iterations: int, warmup: int, workdir: str) -> dict:
+    results = {}
+    for resolution in resolutions:
+        width, height = RESOLUTIONS[resolution]
+        content = synthetic_jpeg(width, height)
+        for case, params in SNAPSHOT_CASES.items():
+            options = snapshot_options(SERVICE_SCHEMA({
+                "camera_entity_id": "camera.benchmark", "file_path": "bench.jpg", **params
+            }))
+            file_path = os.path.join(workdir, f"snapshot_{resolution}_{case}.jpg")
+            latencies = []
+            start = time.perf_counter()
+            for index in range(warmup + iterations):
+                if index == warmup:
+                    latencies.clear()
+                    start = time.perf_counter()
+                event_data = {}
+                call_start = time.perf_counter()
+                process_snapshot(content, file_path, options, event_data)
+                latencies.append(time.perf_counter() - call_start)
+                if not event_data.get("success"):
+                    raise RuntimeError(f"snapshot {resolution}/{case} failed: {event_data.get('error')}")
+            key = f"snapshot/{resolution}/{case}"
+            results[key] = summarize(latencies, time.perf_counter() - start, path=event_data.get("processing_path"))
+            print(f"{key:40} {results[key]['p50_ms']:>9.2f} ms p50 {results[key]['throughput']:>8.2f}/s")
+    return results
+
+
+def render_test_clip(path: str, width: int, height: int, seconds: int):
+    subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=25",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+        "-t", str(seconds), "-c:v", "libx264", "-preset", "veryfast", "-g", "50",
+        "-pix_fmt", "yuv420p", "-c:a", "aac", path,
+    ], check=True)
+
+
+async def run_record_suite(resolutions: list, iterations: int, duration: int, workdir: str) -> dict:
+    from homeassistant.core import HomeAssistant, ServiceCall
+    from custom_components.advanced_snapshot.ingest import IngestManager
+    from custom_components.advanced_snapshot.metrics import TimingStats
+    from custom_components.advanced_snapshot.probe import StreamProbeCache, async_probe_stream
+    from custom_components.advanced_snapshot.scheduler import RecordingScheduler, default_recording_slots
+
+    hass = HomeAssistant(os.path.join(workdir, "config"))
+    probe_cache = StreamProbeCache(hass, 3600)
+    hass.data[DOMAIN] = {
+        "snapshot_folder": workdir,
+        "backup_folder": workdir,
+        "font_folder": FONT_FOLDER,
+        "probe_cache": probe_cache,
+        "ingest_manager": IngestManager(hass, probe_cache, idle_timeout=0),
+        "recording_scheduler": RecordingScheduler(hass, default_recording_slots(), 16),
+        "timing_stats": TimingStats(hass),
+    }
+
+    results = {}
+    fifo = os.path.join(workdir, "camera.ts")
+    os.mkfifo(fifo)
+
+    async def get_stream_source(_hass, _entity_id):
+        return fifo
+
+    try:
+        with mock.patch.object(integration, "async_get_stream_source", get_stream_source), \
+                mock.patch.object(ingest, "async_get_stream_source", get_stream_source):
+            for resolution in resolutions:
+                width, height = RESOLUTIONS[resolution]
+                clip = os.path.join(workdir, f"testsrc_{resolution}.mp4")
+                await hass.async_add_executor_job(render_test_clip, clip, width, height, duration + 10)
+                probe_cache.set(fifo, await async_probe_stream(clip))
+
+                for case, params in RECORD_CASES.items():
+                    data = SERVICE_SCHEMA_RECORD_VIDEO({
+                        "camera_entity_id": "camera.benchmark",
+                        "file_path": f"record_{resolution}_{case}.mp4",
+                        "duration": duration,
+                        **params,
+                    })
+                    latencies = []
+                    cpu_times = []
+                    start = time.perf_counter()
+                    for _ in range(iterations):
+                        # Plays the clip in real time, like a camera would deliver it
+                        feeder = await asyncio.create_subprocess_exec(
+                            "ffmpeg", "-hide_banner", "-loglevel", "error", "-re", "-stream_loop", "-1",
+                            "-i", clip, "-c", "copy", "-f", "mpegts", "-y", fifo,
+                            stdin=asyncio.subprocess.DEVNULL
+                        )
+                        call_start = time.perf_counter()
+                        try:
+                            response = await handle_record_video(hass, ServiceCall(DOMAIN, "record_video", data))
+                        finally:
+                            if feeder.returncode is None:
+                                feeder.kill()
+                            await feeder.wait()
+                        latencies.append(time.perf_counter() - call_start)
+                        if not response.get("success"):
+                            raise RuntimeError(f"record {resolution}/{case} failed: {response.get('error')}")
+                        if response.get("cpu_usage"):
+                            cpu_times.append(response["cpu_usage"]["cpu_time"])
+                    key = f"record/{resolution}/{case}"
+                    results[key] = summarize(
+                        latencies, time.perf_counter() - start,
+                        mode=response.get("mode"),
+                        cpu_time_s=round(sum(cpu_times) / len(cpu_times), 3) if cpu_times else None,
+                    )
+                    print(f"{key:40} {results[key]['p50_ms']:>9.2f} ms p50 cpu {results[key]['cpu_time_s']} s")
+    finally:
+        await hass.data[DOMAIN]["ingest_manager"].async_stop()
+        await hass.async_stop(force=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Return the cases whose p50 latency got worse than the baseline by more than threshold."""
+    regressions = []
+    print(f"\n{'case':40} {'baseline':>10} {'now':>10} {'change':>8}")
+    for key, result in results.items():
+        base = baseline.get("results", {}).get(key)
+        if not base:
+            continue
+        change = (result["p50_ms"] - base["p50_ms"]) / base["p50_ms"] if base["p50_ms"] else 0
+        marker = ""
+        if change > threshold:
+            regressions.append(key)
+            marker = "  REGRESSION"
+        print(f"{key:40} {base['p50_ms']:>10.2f} {result['p50_ms']:>10.2f} {change:>+8.1%}{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", choices=["snapshot", "record", "all"], default="all")
+    parser.add_argument("--resolutions", default="720p,1080p,4k",
+                        help="comma separated, from " + ", ".join(RESOLUTIONS))
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--record-iterations", type=int, default=2)
+    parser.add_argument("--record-duration", type=int, default=5)
+    parser.add_argument("--save", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed p50 slowdown, default 0.1 (10 %%)")
+    args = parser.parse_args()
+
+    resolutions = [r.strip() for r in args.resolutions.split(",") if r.strip()]
+    for resolution in resolutions:
+        if resolution not in RESOLUTIONS:
+            parser.error(f"unknown resolution {resolution}")
+
+    workdir = tempfile.mkdtemp(prefix="advanced_snapshot_bench_")
+    results = {}
+    try:
+        if args.suite in ("snapshot", "all"):
+            results.update(run_snapshot_suite(resolutions, args.iterations, args.warmup, workdir))
+        if args.suite in ("record", "all"):
+            if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+                print("ffmpeg/ffprobe not found, skipping the record suite")
+            else:
+                results.update(asyncio.run(
+                    run_record_suite(resolutions, args.record_iterations, args.record_duration, workdir)
+                ))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pillow": Image.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
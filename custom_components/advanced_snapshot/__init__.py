@@ -2,14 +2,19 @@ import os
 import logging
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
-import aiofiles
 import asyncio
 import datetime
 import math
+import re
+import time
 import codecs
 import shutil
+import tempfile
+import contextlib
+import sqlite3
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse, callback
 from homeassistant.components.camera import async_get_image
 from homeassistant.components.camera import async_get_stream_source
 from homeassistant.components.ffmpeg import get_ffmpeg_manager
@@ -18,19 +23,63 @@ import subprocess
 from functools import partial
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
-from .const import DOMAIN
+from homeassistant.helpers.start import async_at_started
+from homeassistant.util import dt as dt_util
+from .const import (
+    DOMAIN, DEFAULT_IMAGE_WORKERS, DEFAULT_IMAGE_QUEUE_SIZE, DEFAULT_PROBE_CACHE_TTL,
+    DEFAULT_PRERECORD_FOLDER, DEFAULT_PRERECORD_SECONDS, DEFAULT_PRERECORD_MAX_MB,
+    DEFAULT_RECORDING_SLOTS, DEFAULT_RECORDING_QUEUE_SIZE,
+    DEFAULT_RETENTION_MAX_AGE_DAYS, DEFAULT_RETENTION_MAX_SIZE_MB, DEFAULT_RETENTION_MAX_FILES,
+    DEFAULT_LATEST_CACHE_MB
+)
+from .image_pool import ImageProcessingPool, ImagePoolFullError
+from .overlay import TEXT_MARGIN, get_bar_template, cache_stats
+from .jpeg import can_transform_lossless, transform_lossless
+from .geometry import GeometryError, plan_geometry
+from .storage import encode_image, image_format_for, save_image, write_bytes, write_concat_list
+from .probe import StreamProbeCache, async_probe_stream
+from .prerecord import PrerecordBuffer
+from .ingest import IngestManager, ingest_audio_codec
+from .ffmpeg_process import FFmpegProcess, FFmpegTimeoutError
+from .metrics import StageTimer, TimingStats, run_profiled
+from .timelapse import TimelapseManager
+from .retention import RetentionManager
+from .backup import BackupQueue
+from .container import (
+    CONTAINERS, DEFAULT_CONTAINER, container_args, container_files, is_available, local_url, playlist_exists,
+    remove_container_files
+)
+from .encoder import DEFAULT_ENCODER_PROFILE, ENCODER_PROFILES, EncoderTuner, encoder_profile, realtime_factor
+from .catalog import MediaCatalog
+from .change import ChangeDetector, fingerprint
+from .latest import LatestImageCache, LatestSnapshotView, latest_url
+from .scheduler import PRIORITIES, RecordingScheduler, RecordingQueueFullError, default_recording_slots
+from .frame_tap import FrameTapManager
 
     
 
 _LOGGER = logging.getLogger(__name__)
 
-SERVICE_SCHEMA = vol.Schema({
-    vol.Required("camera_entity_id"): cv.entity_id,
+SNAPSHOT_OUTPUT_SCHEMA = vol.Schema({
     vol.Required("file_path"): cv.string,
+    vol.Optional("name"): vol.Match(r"^[\w.-]+$"),
+    vol.Optional("format", default=None): vol.Any(None, vol.In(["jpeg", "png", "webp"])),
+    vol.Optional("max_size", default=None): vol.Any(None, vol.All([vol.All(vol.Coerce(int), vol.Range(min=1))], vol.Length(min=2, max=2))),
+    vol.Optional("image_quality", default=None): vol.Any(None, vol.All(vol.Coerce(int), vol.Range(min=1, max=100))),
+    vol.Optional("image_optimize", default=False): cv.boolean,
+    vol.Optional("image_progressive", default=False): cv.boolean
+})
+
+SERVICE_SCHEMA = vol.All(vol.Schema({
+    vol.Required("camera_entity_id"): cv.entity_id,
+    vol.Optional("file_path"): cv.string,
     vol.Optional("file_path_backup"): cv.string,
+    vol.Optional("outputs"): vol.All([SNAPSHOT_OUTPUT_SCHEMA], vol.Length(min=1)),
+    vol.Optional("source", default="camera"): vol.In(["camera", "stream"]),
     vol.Optional("rotate_angle", default=0): vol.All(vol.Coerce(int), vol.Range(min=0, max=360)),
     vol.Optional("crop", default=None): vol.Any(None, [vol.Coerce(int)]),
     vol.Optional("crop_aspect_ratio", default=None): vol.Any(None, vol.Match(r"^\d+:\d+$")),
+    vol.Optional("max_size", default=None): vol.Any(None, vol.All([vol.All(vol.Coerce(int), vol.Range(min=1))], vol.Length(min=2, max=2))),
     vol.Optional("add_bar", default=False): cv.boolean,
     vol.Optional("custom_text_left", default=""): cv.string,
     vol.Optional("custom_text_middle", default=""): cv.string,
@@ -40,17 +89,61 @@ SERVICE_SCHEMA = vol.Schema({
     vol.Optional("setting_font_color", default="black"): cv.string,
     vol.Optional("setting_bar_height", default="40"): vol.Any(vol.Coerce(int), vol.Match(r"^\d+%$")),
     vol.Optional("setting_bar_color", default="white"): cv.string,
-    vol.Optional("setting_bar_position", default="bottom"): cv.string
-})
+    vol.Optional("setting_bar_position", default="bottom"): cv.string,
+    vol.Optional("image_quality", default=None): vol.Any(None, vol.All(vol.Coerce(int), vol.Range(min=1, max=100))),
+    vol.Optional("image_optimize", default=False): cv.boolean,
+    vol.Optional("image_progressive", default=False): cv.boolean,
+    vol.Optional("fsync", default=False): cv.boolean,
+    vol.Optional("persist", default=True): cv.boolean,
+    vol.Optional("skip_if_unchanged", default=False): cv.boolean,
+    vol.Optional("change_threshold", default=3): vol.All(vol.Coerce(float), vol.Range(min=0, max=100)),
+    vol.Optional("debug_profile", default=False): cv.boolean
+}), cv.has_at_least_one_key("file_path", "outputs"))
 
 SERVICE_SCHEMA_RECORD_VIDEO = vol.Schema({
     vol.Required("camera_entity_id"): cv.entity_id,
     vol.Required("file_path"): cv.string,
     vol.Optional("file_path_backup"): cv.string,
-    vol.Optional("duration", default=40): vol.All(vol.Coerce(int), vol.Range(min=1, max=40)),
+    vol.Optional("duration", default=40): vol.All(vol.Coerce(int), vol.Range(min=1, max=300)),
+    vol.Optional("pre_seconds", default=0): vol.All(vol.Coerce(int), vol.Range(min=0, max=300)),
+    vol.Optional("priority", default="normal"): vol.In(list(PRIORITIES)),
+    vol.Optional("encoder_profile", default=DEFAULT_ENCODER_PROFILE): vol.In(ENCODER_PROFILES),
+    vol.Optional("container", default=DEFAULT_CONTAINER): vol.In(CONTAINERS),
+    vol.Optional("rotate_angle", default=0): vol.All(vol.Coerce(int), vol.Range(min=0, max=360)),
+    vol.Optional("crop", default=None): vol.Any(None, [vol.Coerce(int)]),
+    vol.Optional("crop_aspect_ratio", default=None): vol.Any(None, vol.Match(r"^\d+:\d+$")),
+    vol.Optional("add_bar", default=False): cv.boolean,
+    vol.Optional("custom_text_left", default=""): cv.string,
+    vol.Optional("custom_text_middle", default=""): cv.string,
+    vol.Optional("custom_text_right", default=""): cv.string,
+    vol.Optional("setting_font_path", default="/config/custom_components/advanced_snapshot/fonts/Arial.ttf"): cv.string,
+    vol.Optional("setting_font_size", default="auto"): vol.Any(vol.Coerce(int), vol.In(["auto"])),
+    vol.Optional("setting_font_color", default="black"): cv.string,
+    vol.Optional("setting_bar_height", default="40"): vol.Any(vol.Coerce(int), vol.Match(r"^\d+%$")),
+    vol.Optional("setting_bar_color", default="white"): cv.string,
+    vol.Optional("setting_bar_position", default="bottom"): cv.string,
+    vol.Optional("live_timestamp", default="none"): vol.In(["none", "left", "middle", "right"]),
+    vol.Optional("live_timestamp_format", default="%d.%m.%y %H:%M:%S"): cv.string
+})
+
+SERVICE_SCHEMA_BATCH = vol.Schema({
+    vol.Required("cameras"): vol.All(cv.ensure_list, [vol.Any(cv.entity_id, dict)]),
+    vol.Optional("template", default={}): dict,
+    vol.Optional("timeout", default=10): vol.All(vol.Coerce(float), vol.Range(min=1, max=120))
+})
+
+SERVICE_SCHEMA_TIMELAPSE = vol.Schema({
+    vol.Required("camera_entity_id"): cv.entity_id,
+    vol.Required("file_path"): cv.string,
+    vol.Optional("session_id"): cv.slug,
+    vol.Optional("source", default="camera"): vol.In(["camera", "stream"]),
+    vol.Optional("interval", default=60): vol.All(vol.Coerce(float), vol.Range(min=1)),
+    vol.Optional("duration", default=86400): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional("fps", default=25): vol.All(vol.Coerce(int), vol.Range(min=1, max=60)),
     vol.Optional("rotate_angle", default=0): vol.All(vol.Coerce(int), vol.Range(min=0, max=360)),
     vol.Optional("crop", default=None): vol.Any(None, [vol.Coerce(int)]),
     vol.Optional("crop_aspect_ratio", default=None): vol.Any(None, vol.Match(r"^\d+:\d+$")),
+    vol.Optional("max_size", default=None): vol.Any(None, vol.All([vol.All(vol.Coerce(int), vol.Range(min=1))], vol.Length(min=2, max=2))),
     vol.Optional("add_bar", default=False): cv.boolean,
     vol.Optional("custom_text_left", default=""): cv.string,
     vol.Optional("custom_text_middle", default=""): cv.string,
@@ -63,9 +156,36 @@ SERVICE_SCHEMA_RECORD_VIDEO = vol.Schema({
     vol.Optional("setting_bar_position", default="bottom"): cv.string
 })
 
+SERVICE_SCHEMA_STOP_TIMELAPSE = vol.Schema({
+    vol.Optional("session_id"): cv.slug,
+    vol.Optional("camera_entity_id"): cv.entity_id
+})
+
+SERVICE_SCHEMA_LIST_MEDIA = vol.Schema({
+    vol.Optional("camera_entity_id"): cv.entity_id,
+    vol.Optional("media_type"): vol.In(["snapshot", "video", "timelapse"]),
+    vol.Optional("start"): cv.datetime,
+    vol.Optional("end"): cv.datetime,
+    vol.Optional("limit", default=50): vol.All(vol.Coerce(int), vol.Range(min=1, max=500)),
+    vol.Optional("cursor"): vol.All(vol.Coerce(int), vol.Range(min=1))
+})
+
+SERVICE_SCHEMA_INVALIDATE_PROBE_CACHE = vol.Schema({
+    vol.Optional("camera_entity_id"): cv.entity_id
+})
+
+# Extra seconds ffmpeg may need on top of twice the clip duration
+RECORD_TIMEOUT_MARGIN = 30
+
+MP4_VIDEO_CODECS = {"h264", "hevc", "av1", "mpeg4"}
+MP4_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "opus", "alac"}
+
 CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
 
+PLATFORMS = ["sensor"]
+
 async def async_setup(hass: HomeAssistant, config: dict):
+    hass.http.register_view(LatestSnapshotView(hass))
     _LOGGER.info("Registering the take_snapshot service.")
     hass.services.async_register(
         DOMAIN, "take_snapshot", partial(handle_take_snapshot, hass),
@@ -75,11 +195,81 @@ async def async_setup(hass: HomeAssistant, config: dict):
         DOMAIN, "record_video", partial(handle_record_video, hass),
         schema=SERVICE_SCHEMA_RECORD_VIDEO, supports_response=SupportsResponse.OPTIONAL
     )
+    hass.services.async_register(
+        DOMAIN, "take_snapshot_batch", partial(handle_take_snapshot_batch, hass),
+        schema=SERVICE_SCHEMA_BATCH, supports_response=SupportsResponse.OPTIONAL
+    )
     return True
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     _LOGGER.info(f"Loading Advanced Snapshot configuration: {entry.data}")
-    hass.data[DOMAIN] = entry.data
+    image_pool = ImageProcessingPool(
+        entry.data.get("image_workers", DEFAULT_IMAGE_WORKERS),
+        entry.data.get("image_queue_size", DEFAULT_IMAGE_QUEUE_SIZE)
+    )
+    probe_cache = StreamProbeCache(hass, entry.data.get("probe_cache_ttl", DEFAULT_PROBE_CACHE_TTL))
+    ingest_manager = IngestManager(hass, probe_cache)
+    frame_taps = FrameTapManager(hass, ingest_manager, probe_cache)
+    timelapse_manager = TimelapseManager(hass, partial(async_capture_timelapse_frame, hass))
+    await timelapse_manager.async_load()
+    recording_scheduler = RecordingScheduler(
+        hass,
+        entry.data.get("recording_slots", DEFAULT_RECORDING_SLOTS) or default_recording_slots(),
+        entry.data.get("recording_queue_size", DEFAULT_RECORDING_QUEUE_SIZE)
+    )
+    latest_cache_mb = entry.data.get("latest_cache_mb", DEFAULT_LATEST_CACHE_MB)
+    latest_cache = LatestImageCache(latest_cache_mb * 1024 * 1024) if latest_cache_mb else None
+    catalog = MediaCatalog(hass, hass.config.path(DOMAIN, "catalog.db"))
+    try:
+        await catalog.async_setup()
+    except sqlite3.Error as e:
+        _LOGGER.error(f"Media catalog could not be opened, list_media is not available: {str(e)}")
+        await catalog.async_close()
+        catalog = None
+    retention = None
+    max_age_days = entry.data.get("retention_max_age_days", DEFAULT_RETENTION_MAX_AGE_DAYS)
+    max_size_mb = entry.data.get("retention_max_size_mb", DEFAULT_RETENTION_MAX_SIZE_MB)
+    max_files = entry.data.get("retention_max_files", DEFAULT_RETENTION_MAX_FILES)
+    if max_age_days or max_size_mb or max_files:
+        retention = RetentionManager(
+            hass, [entry.data.get("snapshot_folder"), entry.data.get("backup_folder")],
+            max_age_days * 86400, max_size_mb * 1024 * 1024, max_files,
+            catalog.remove if catalog else None
+        )
+    backup_queue = BackupQueue(
+        hass, hass.config.path(DOMAIN, ".backup_spool"),
+        partial(track_backup, hass)
+    )
+    await backup_queue.async_load()
+    encoder_tuner = EncoderTuner(hass)
+    await encoder_tuner.async_load()
+    prerecord_buffers = {
+        camera_entity_id: PrerecordBuffer(
+            hass, camera_entity_id,
+            entry.data.get("prerecord_folder", DEFAULT_PRERECORD_FOLDER),
+            entry.data.get("prerecord_seconds", DEFAULT_PRERECORD_SECONDS),
+            entry.data.get("prerecord_max_mb", DEFAULT_PRERECORD_MAX_MB) * 1024 * 1024,
+            ingest_manager
+        )
+        for camera_entity_id in entry.data.get("prerecord_cameras", [])
+    }
+    hass.data[DOMAIN] = {
+        **entry.data,
+        "image_pool": image_pool,
+        "probe_cache": probe_cache,
+        "ingest_manager": ingest_manager,
+        "frame_taps": frame_taps,
+        "recording_scheduler": recording_scheduler,
+        "timing_stats": TimingStats(hass),
+        "timelapse_manager": timelapse_manager,
+        "retention": retention,
+        "catalog": catalog,
+        "backup_queue": backup_queue,
+        "encoder_tuner": encoder_tuner,
+        "change_detector": ChangeDetector(),
+        "latest_cache": latest_cache,
+        "prerecord_buffers": prerecord_buffers
+    }
     hass.services.async_register(
         DOMAIN, "take_snapshot", partial(handle_take_snapshot, hass),
         schema=SERVICE_SCHEMA, supports_response=SupportsResponse.OPTIONAL
@@ -88,50 +278,199 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         DOMAIN, "record_video", partial(handle_record_video, hass),
         schema=SERVICE_SCHEMA_RECORD_VIDEO, supports_response=SupportsResponse.OPTIONAL
     )
+    hass.services.async_register(
+        DOMAIN, "take_snapshot_batch", partial(handle_take_snapshot_batch, hass),
+        schema=SERVICE_SCHEMA_BATCH, supports_response=SupportsResponse.OPTIONAL
+    )
+    hass.services.async_register(
+        DOMAIN, "invalidate_probe_cache", partial(handle_invalidate_probe_cache, hass),
+        schema=SERVICE_SCHEMA_INVALIDATE_PROBE_CACHE
+    )
+    hass.services.async_register(
+        DOMAIN, "list_media", partial(handle_list_media, hass),
+        schema=SERVICE_SCHEMA_LIST_MEDIA, supports_response=SupportsResponse.ONLY
+    )
+    hass.services.async_register(
+        DOMAIN, "record_timelapse", partial(handle_record_timelapse, hass),
+        schema=SERVICE_SCHEMA_TIMELAPSE, supports_response=SupportsResponse.OPTIONAL
+    )
+    hass.services.async_register(
+        DOMAIN, "stop_timelapse", partial(handle_stop_timelapse, hass),
+        schema=SERVICE_SCHEMA_STOP_TIMELAPSE, supports_response=SupportsResponse.OPTIONAL
+    )
+
+    @callback
+    def _prime_probe_cache(_hass):
+        hass.async_create_background_task(
+            async_prime_probe_cache(hass, probe_cache), f"{DOMAIN}.prime_probe_cache"
+        )
+        for prerecord in prerecord_buffers.values():
+            prerecord.start()
+        timelapse_manager.resume()
+        backup_queue.start()
+        if retention:
+            retention.start()
+
+    @callback
+    def _register_timelapse(event):
+        if event.data.get("success"):
+            register_media(
+                hass, event.data.get("camera_entity_id"), "timelapse", event.data.get("file_path"),
+                resolution=event.data.get("resolution"), options={"frames": event.data.get("frames")}
+            )
+
+    async def _async_stop_timelapses(_event):
+        await timelapse_manager.async_stop()
+
+    entry.async_on_unload(async_at_started(hass, _prime_probe_cache))
+    entry.async_on_unload(hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _async_stop_timelapses))
+    entry.async_on_unload(hass.bus.async_listen(f"{DOMAIN}_timelapse_finished", _register_timelapse))
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
     return True
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     _LOGGER.info("Unloading Advanced Snapshot integration.")
+    if not await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
+        return False
     hass.services.async_remove(DOMAIN, "take_snapshot")
+    hass.services.async_remove(DOMAIN, "take_snapshot_batch")
+    hass.services.async_remove(DOMAIN, "invalidate_probe_cache")
+    hass.services.async_remove(DOMAIN, "record_timelapse")
+    hass.services.async_remove(DOMAIN, "list_media")
+    hass.services.async_remove(DOMAIN, "stop_timelapse")
     hass.services.async_remove(DOMAIN, "handle_record_video")
     if DOMAIN in hass.data:
+        image_pool = hass.data[DOMAIN].get("image_pool")
+        if image_pool:
+            image_pool.shutdown()
+        timelapse_manager = hass.data[DOMAIN].get("timelapse_manager")
+        if timelapse_manager:
+            await timelapse_manager.async_stop()
+        retention = hass.data[DOMAIN].get("retention")
+        if retention:
+            await retention.async_stop()
+        catalog = hass.data[DOMAIN].get("catalog")
+        if catalog:
+            await catalog.async_close()
+        backup_queue = hass.data[DOMAIN].get("backup_queue")
+        if backup_queue:
+            await backup_queue.async_stop()
+        encoder_tuner = hass.data[DOMAIN].get("encoder_tuner")
+        if encoder_tuner:
+            await encoder_tuner.async_save()
+        for prerecord in hass.data[DOMAIN].get("prerecord_buffers", {}).values():
+            await prerecord.async_stop()
+        frame_taps = hass.data[DOMAIN].get("frame_taps")
+        if frame_taps:
+            await frame_taps.async_stop()
+        ingest_manager = hass.data[DOMAIN].get("ingest_manager")
+        if ingest_manager:
+            await ingest_manager.async_stop()
         del hass.data[DOMAIN]
     return True
 
+async def async_prime_probe_cache(hass: HomeAssistant, probe_cache: StreamProbeCache):
+    """Probe the streams of all cameras in the background, two at a time."""
+    semaphore = asyncio.Semaphore(2)
+
+    async def _prime(entity_id):
+        async with semaphore:
+            try:
+                stream = await async_get_stream_source(hass, entity_id)
+            except Exception as e:
+                _LOGGER.debug(f"No stream source for {entity_id}: {str(e)}")
+                return
+            if stream:
+                await probe_cache.async_probe(stream)
+
+    await asyncio.gather(*(_prime(entity_id) for entity_id in hass.states.async_entity_ids("camera")))
+
+async def handle_invalidate_probe_cache(hass: HomeAssistant, call: ServiceCall):
+    probe_cache = hass.data.get(DOMAIN, {}).get("probe_cache")
+    if not probe_cache:
+        return
+    camera_entity_id = call.data.get("camera_entity_id")
+    if not camera_entity_id:
+        probe_cache.invalidate()
+        return
+    stream = await async_get_stream_source(hass, camera_entity_id)
+    if stream:
+        probe_cache.invalidate(stream)
+        probe_cache.async_refresh(stream)
+
 async def handle_take_snapshot(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
     _LOGGER.info("Received snapshot request.")
+    return await async_take_snapshot(hass, call.data)
+
+async def handle_take_snapshot_batch(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    cameras = call.data["cameras"]
+    template = call.data.get("template", {})
+    timeout = call.data.get("timeout")
+    _LOGGER.info(f"Received batch snapshot request for {len(cameras)} cameras.")
+
+    async def _take(camera):
+        if isinstance(camera, str):
+            camera = {"camera_entity_id": camera}
+        camera_entity_id = camera.get("camera_entity_id")
+        start = time.monotonic()
+        try:
+            options = {**template, **camera}
+            object_id = str(camera_entity_id).split(".", 1)[-1]
+            for key in ("file_path", "file_path_backup"):
+                if isinstance(options.get(key), str):
+                    options[key] = options[key].replace("{camera}", object_id)
+            if isinstance(options.get("outputs"), list):
+                options["outputs"] = [
+                    {**output, "file_path": output["file_path"].replace("{camera}", object_id)}
+                    if isinstance(output, dict) and isinstance(output.get("file_path"), str) else output
+                    for output in options["outputs"]
+                ]
+            options = SERVICE_SCHEMA(options)
+        except vol.Invalid as e:
+            result = {"success": False, "error": f"Invalid options: {str(e)}"}
+        else:
+            try:
+                result = await async_take_snapshot(hass, options, timeout)
+            except Exception as e:
+                _LOGGER.exception(f"Error while taking snapshot of {camera_entity_id}: {str(e)}")
+                result = {"success": False, "error": str(e)}
+        result["camera_entity_id"] = camera_entity_id
+        result["duration"] = round(time.monotonic() - start, 3)
+        return result
+
+    start = time.monotonic()
+    results = await asyncio.gather(*(_take(camera) for camera in cameras))
+    return {
+        "success": all(result["success"] for result in results),
+        "duration": round(time.monotonic() - start, 3),
+        "results": list(results)
+    }
+
+async def async_take_snapshot(hass: HomeAssistant, data: dict, timeout: float = 10) -> dict:
+    timer = StageTimer()
+    change_detector = hass.data.get(DOMAIN, {}).get("change_detector")
+    current_fingerprint = None
     try:
-        camera_entity_id = call.data["camera_entity_id"]
-        file_path = call.data["file_path"]
-        file_path_backup = call.data.get("file_path_backup")
-        setting_font_path = call.data.get("setting_font_path")
+        camera_entity_id = data["camera_entity_id"]
+        file_path = data.get("file_path")
+        file_path_backup = data.get("file_path_backup")
 
         snapshot_folder = hass.data.get(DOMAIN, {}).get("snapshot_folder")
         backup_folder = hass.data.get(DOMAIN, {}).get("backup_folder")
-        font_folder = hass.data.get(DOMAIN, {}).get("font_folder")
 
-        if not os.path.isabs(file_path):
+        if file_path and not os.path.isabs(file_path):
             file_path = os.path.join(snapshot_folder, file_path)
 
         if file_path_backup and not os.path.isabs(file_path_backup):
             file_path_backup = os.path.join(backup_folder, file_path_backup)
 
-        if not os.path.isabs(setting_font_path):
-            setting_font_path = os.path.join(font_folder, setting_font_path)
-        if not os.path.splitext(setting_font_path)[1]:  
-            setting_font_path += ".ttf"
-        rotate_angle = call.data.get("rotate_angle")
-        crop = call.data.get("crop")
-        crop_aspect_ratio = call.data.get("crop_aspect_ratio")
-        add_bar = call.data.get("add_bar", False)
-        custom_text_left = call.data.get("custom_text_left", "")
-        custom_text_middle = call.data.get("custom_text_middle", "")
-        custom_text_right = call.data.get("custom_text_right", "")
-        setting_font_size = call.data.get("setting_font_size")
-        setting_font_color = call.data.get("setting_font_color", "black")
-        setting_bar_height = call.data.get("setting_bar_height")
-        setting_bar_color = call.data.get("setting_bar_color", "white")
-        setting_bar_position = call.data.get("setting_bar_position", "bottom")
+        options = build_snapshot_options(hass, data)
+        outputs = build_snapshot_outputs(data, file_path, options, snapshot_folder)
+        if outputs:
+            file_path = outputs[0]["file_path"]
+        latest_cache = hass.data.get(DOMAIN, {}).get("latest_cache")
+        if not options["persist"]:
+            file_path_backup = None
 
         event_data = {
             "success": False,
@@ -142,93 +481,531 @@ async def handle_take_snapshot(hass: HomeAssistant, call: ServiceCall) -> Servic
             "error": None
         }
 
-        image = await async_get_image(hass, camera_entity_id)
-        if image is None or not hasattr(image, "content"):
-            _LOGGER.error("Failed to retrieve image from camera.")
-            event_data["error"] = "Image could not be retrieved"
+        if not options["persist"] and not latest_cache:
+            event_data["error"] = "persist: false needs the latest snapshot cache, which is disabled"
             return event_data
 
-        img = Image.open(BytesIO(image.content))
-        event_data["original_resolution"] = [img.width, img.height]
-        
-        if rotate_angle:
-            img = img.rotate(rotate_angle, expand=True)
-            _LOGGER.info(f"Rotated image by {rotate_angle} degrees")
-            
-        if crop:
-            if len(crop) < 3:
-                _LOGGER.error("Invalid crop values: crop must have at least [x, y, width]")
-                event_data["error"] = "Invalid crop values"
-                return event_data
+        with timer.stage("fetch"):
+            image_content = await async_fetch_image(hass, camera_entity_id, data.get("source"), timeout, event_data)
+        if image_content is None:
+            return event_data
 
-            x, y, w = crop[:3]
-            h = crop[3] if len(crop) == 4 else None
-
-            if crop_aspect_ratio:
-                try:
-                    aspect_w, aspect_h = map(int, crop_aspect_ratio.split(":"))
-                    h = int(w * (aspect_h / aspect_w))
-                    _LOGGER.info(f"Using aspect ratio {crop_aspect_ratio}, calculated height: {h}")
-                except ValueError:
-                    _LOGGER.error(f"Invalid aspect ratio format: {crop_aspect_ratio}")
-                    event_data["error"] = "Invalid aspect ratio format"
-                    return event_data
-
-            if h is None:
-                _LOGGER.error("Height (h) is missing and no aspect ratio provided.")
-                event_data["error"] = "Height (h) is missing and no aspect ratio provided."
+        if data.get("skip_if_unchanged") and change_detector:
+            try:
+                with timer.stage("fingerprint"):
+                    current_fingerprint = await async_run_image_job(
+                        hass, event_data, fingerprint, image_content,
+                        options["rotate_angle"], options["crop"], options["crop_aspect_ratio"]
+                    )
+            except ImagePoolFullError as e:
+                event_data["error"] = str(e)
                 return event_data
-
-            if x < 0 or y < 0 or w <= 0 or h <= 0:
-                _LOGGER.error(f"Invalid crop dimensions: {x, y, w, h}")
-                event_data["error"] = "Invalid crop dimensions"
+            score = change_detector.score(camera_entity_id, file_path, current_fingerprint)
+            event_data["change_score"] = score
+            event_data["skipped"] = score is not None and score < data["change_threshold"]
+            if event_data["skipped"]:
+                _LOGGER.info(f"Snapshot of {camera_entity_id} skipped, change {score}% below {data['change_threshold']}%")
+                event_data["success"] = True
+                event_data["timings"] = timer.result()
                 return event_data
 
-            if (x + w) > img.width or (y + h) > img.height:
-                _LOGGER.error(f"Invalid crop area: ({x}, {y}, {w}, {h}) exceeds image size")
-                event_data["error"] = "Invalid crop area"
-                return event_data
-            
-            img = img.crop((x, y, x + w, y + h))
+        if outputs:
+            func = render_shared_image
+            job_args = (image_content, outputs, options, event_data, timer)
+        else:
+            publish = None
+            if latest_cache:
+                name = os.path.basename(file_path)
+                publish = partial(latest_cache.put, camera_entity_id, name, main=True)
+                event_data["url"] = latest_url(camera_entity_id, name)
+            func = process_snapshot
+            job_args = (image_content, file_path, options, event_data, timer, publish)
+        try:
+            if data.get("debug_profile"):
+                object_id = camera_entity_id.split(".", 1)[-1]
+                profile_path = hass.config.path(
+                    DOMAIN, "profiles", f"{object_id}_{datetime.datetime.now():%Y%m%d_%H%M%S}.prof"
+                )
+                event_data["profile_path"] = profile_path
+                img = await async_run_image_job(hass, event_data, run_profiled, profile_path, func, *job_args)
+            else:
+                img = await async_run_image_job(hass, event_data, func, *job_args)
+            if outputs and img is not None:
+                await async_write_outputs(hass, camera_entity_id, img, outputs, options, event_data, timer)
+            if event_data["success"] and file_path_backup:
+                # The backup is a copy of the first rendition
+                error = await async_queue_backup(hass, camera_entity_id, file_path, file_path_backup, timer)
+                if error:
+                    event_data["success"] = False
+                    event_data["error"] = error
+                else:
+                    event_data["backup"] = "queued"
+        except ImagePoolFullError as e:
+            event_data["error"] = str(e)
 
-        if add_bar:
-            _LOGGER.debug("Adding text bar to image.")
-            img = add_text_bar(
-                img, custom_text_left, custom_text_middle, custom_text_right,
-                setting_font_path, setting_font_size, setting_font_color,
-                setting_bar_height, setting_bar_color, setting_bar_position, event_data
+    except Exception as e:
+        _LOGGER.exception(f"Error while taking snapshot: {str(e)}")
+        event_data["error"] = str(e)
+
+    event_data["timings"] = timer.result()
+    timing_stats = hass.data.get(DOMAIN, {}).get("timing_stats")
+    if timing_stats and event_data["success"]:
+        timing_stats.add(data["camera_entity_id"], "snapshot", event_data["timings"])
+    if event_data["success"] and current_fingerprint is not None:
+        change_detector.update(data["camera_entity_id"], file_path, current_fingerprint)
+    if event_data["success"] and options["persist"]:
+        media_options = media_options_of(data)
+        if event_data.get("outputs"):
+            # The backup is a copy of the first rendition
+            backup_path = event_data.get("backup_path")
+            for output in event_data["outputs"]:
+                register_media(
+                    hass, data["camera_entity_id"], "snapshot", output["file_path"], backup_path,
+                    output["resolution"], {**media_options, "format": output["format"]}
+                )
+                backup_path = None
+        else:
+            register_media(
+                hass, data["camera_entity_id"], "snapshot", event_data["file_path"], event_data.get("backup_path"),
+                event_data["final_resolution"], media_options
             )
+    return event_data
 
-        event_data["final_resolution"] = [img.width, img.height]
+def media_options_of(data: dict) -> dict:
+    """Options of a service call as stored in the media catalog."""
+    return {
+        key: value for key, value in data.items()
+        if key not in ("camera_entity_id", "file_path", "file_path_backup", "outputs", "debug_profile",
+                       "skip_if_unchanged", "change_threshold", "persist")
+    }
 
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        await async_save_image(img, file_path)
-        _LOGGER.info(f"Snapshot saved at {file_path}")
+@callback
+def register_media(hass: HomeAssistant, camera_entity_id: str, media_type: str, file_path: str,
+                   backup_path: str = None, resolution=None, options: dict = None):
+    """Hand a newly written file to the retention manager and the media catalog, if configured."""
+    if not file_path:
+        return
+    retention = hass.data.get(DOMAIN, {}).get("retention")
+    if retention:
+        retention.track(file_path, camera_entity_id)
+    catalog = hass.data.get(DOMAIN, {}).get("catalog")
+    if catalog:
+        catalog.add(camera_entity_id, media_type, file_path, backup_path, resolution, options)
+
+@callback
+def track_backup(hass: HomeAssistant, camera_entity_id: str, backup_path: str):
+    """Hand a backup written by the backup queue to the retention manager."""
+    retention = hass.data.get(DOMAIN, {}).get("retention")
+    if retention:
+        retention.track(backup_path, camera_entity_id)
+
+async def async_queue_backup(hass: HomeAssistant, camera_entity_id: str, file_path: str,
+                             backup_path: str, timer: StageTimer):
+    """Hand a written file to the backup queue; returns an error message if that failed."""
+    with timer.stage("backup"):
+        error = await hass.data[DOMAIN]["backup_queue"].async_enqueue(camera_entity_id, file_path, backup_path)
+    return f"Backup failed: {error}" if error else None
+
+def build_snapshot_outputs(data: dict, file_path: str, options: dict, snapshot_folder: str) -> list:
+    """Renditions of a take_snapshot call with outputs, file_path first; empty without outputs."""
+    if not data.get("outputs"):
+        return []
+
+    outputs = []
+    if file_path:
+        outputs.append({
+            "file_path": file_path,
+            "name": os.path.basename(file_path),
+            "format": image_format_for(file_path),
+            "max_size": options["max_size"],
+            "encoder": options["encoder"],
+        })
+    for output in data["outputs"]:
+        output_path = output["file_path"]
+        if not os.path.isabs(output_path):
+            output_path = os.path.join(snapshot_folder, output_path)
+        outputs.append({
+            "file_path": output_path,
+            "name": output.get("name") or os.path.basename(output_path),
+            "format": output["format"].upper() if output.get("format") else image_format_for(output_path),
+            "max_size": output.get("max_size"),
+            "encoder": {
+                "quality": output.get("image_quality"),
+                "optimize": output.get("image_optimize", False),
+                "progressive": output.get("image_progressive", False),
+            },
+        })
+    return outputs
+
+def build_snapshot_options(hass: HomeAssistant, data: dict) -> dict:
+    """Collect the image options of a validated service call for render_snapshot."""
+    setting_font_path = data.get("setting_font_path")
+    font_folder = hass.data.get(DOMAIN, {}).get("font_folder")
+    if not os.path.isabs(setting_font_path):
+        setting_font_path = os.path.join(font_folder, setting_font_path)
+    if not os.path.splitext(setting_font_path)[1]:  
+        setting_font_path += ".ttf"
 
-        if file_path_backup:
-            try:
-                os.makedirs(os.path.dirname(file_path_backup), exist_ok=True)
-                await async_save_image(img, file_path_backup)
-                _LOGGER.info(f"Backup snapshot saved at {file_path_backup}")
-                event_data["backup_path"] = file_path_backup
-            except Exception as e:
-                _LOGGER.error(f"Backup failed: {str(e)}")
-                event_data["error"] = f"Backup failed: {str(e)}"
-                event_data["success"] = False  
+    return {
+        "rotate_angle": data.get("rotate_angle"),
+        "crop": data.get("crop"),
+        "crop_aspect_ratio": data.get("crop_aspect_ratio"),
+        "add_bar": data.get("add_bar", False),
+        "custom_text_left": data.get("custom_text_left", ""),
+        "custom_text_middle": data.get("custom_text_middle", ""),
+        "custom_text_right": data.get("custom_text_right", ""),
+        "setting_font_path": setting_font_path,
+        "setting_font_size": data.get("setting_font_size"),
+        "setting_font_color": data.get("setting_font_color", "black"),
+        "setting_bar_height": data.get("setting_bar_height"),
+        "setting_bar_color": data.get("setting_bar_color", "white"),
+        "setting_bar_position": data.get("setting_bar_position", "bottom"),
+        "max_size": data.get("max_size"),
+        "encoder": {
+            "quality": data.get("image_quality"),
+            "optimize": data.get("image_optimize", False),
+            "progressive": data.get("image_progressive", False),
+        },
+        "fsync": data.get("fsync", False),
+        "persist": data.get("persist", True),
+    }
+
+async def async_fetch_image(hass: HomeAssistant, camera_entity_id: str, source: str,
+                            timeout: float, event_data: dict):
+    """Return the camera image data or a decoded stream frame, or None."""
+    image_content = None
+    frame_taps = hass.data.get(DOMAIN, {}).get("frame_taps")
+    if source == "stream" and frame_taps:
+        try:
+            image_content = await frame_taps.async_next_frame(camera_entity_id, timeout)
+        except asyncio.TimeoutError:
+            _LOGGER.warning(f"No keyframe from the stream of {camera_entity_id} within {timeout}s")
+        if image_content is None:
+            _LOGGER.warning(f"Stream frame of {camera_entity_id} not available, using the camera image")
+        else:
+            event_data["source"] = "stream"
+            return image_content
+
+    image = await async_get_image(hass, camera_entity_id, timeout=timeout)
+    if image is None or not hasattr(image, "content"):
+        _LOGGER.error("Failed to retrieve image from camera.")
+        event_data["error"] = "Image could not be retrieved"
+        return None
+    event_data["source"] = "camera"
+    return image.content
+
+async def async_run_image_job(hass: HomeAssistant, event_data: dict, func, *args):
+    """Run a blocking image job on the image pool and report the queue state."""
+    pool = hass.data.get(DOMAIN, {}).get("image_pool")
+    if pool is None:
+        return await hass.async_add_executor_job(func, *args)
+
+    event_data["queue"] = {"depth": pool.queue_depth, "rejected": pool.rejected}
+    try:
+        return await pool.async_submit(func, *args)
+    finally:
+        event_data["queue"]["rejected"] = pool.rejected
+
+def render_snapshot(image_content, options: dict, event_data: dict, timer: StageTimer,
+                    allow_lossless: bool = True):
+    """Decode and transform a snapshot. Runs in a worker thread.
+
+    image_content is either encoded image data or an already decoded
+    stream frame. Returns (img, None), or (None, jpeg_data) if the JPEG
+    could be transformed without decoding, or (None, None) on invalid
+    options.
+    """
+    rotate_angle = options["rotate_angle"] or 0
+    max_size = options.get("max_size")
+
+    if isinstance(image_content, Image.Image):
+        img = image_content
+        event_data["processing_path"] = "stream_frame"
+    else:
+        img = Image.open(BytesIO(image_content))
+        event_data["processing_path"] = "decode"
+    original_width, original_height = img.size
+    event_data["original_resolution"] = [original_width, original_height]
+
+    try:
+        plan = plan_geometry(img.size, rotate_angle, options["crop"], options["crop_aspect_ratio"])
+    except GeometryError as e:
+        _LOGGER.error(f"Invalid crop options {options['crop']}: {str(e)}")
+        event_data["error"] = str(e)
+        return None, None
+    crop_box = plan.crop_box
+
+    region_width, region_height = plan.output_size
+    scale = 1.0
+    if max_size:
+        scale = min(1.0, max_size[0] / region_width, max_size[1] / region_height)
+    target_size = (max(1, round(region_width * scale)), max(1, round(region_height * scale)))
+
+    encoded = None
+    reencode = any(options["encoder"].values())
+    if scale == 1.0 and not options["add_bar"] and not reencode and allow_lossless \
+            and can_transform_lossless(img, rotate_angle, crop_box):
+        with timer.stage("lossless_transform"):
+            encoded = transform_lossless(image_content, rotate_angle, crop_box)
+        if encoded is not None:
+            event_data["processing_path"] = "jpeg_lossless"
+            event_data["final_resolution"] = list(target_size)
+
+    if encoded is None:
+        if img.format == "JPEG" and scale < 1.0:
+            img.draft(img.mode, (math.ceil(original_width * scale), math.ceil(original_height * scale)))
+            if img.width < original_width:
+                event_data["processing_path"] = "jpeg_draft"
+                _LOGGER.debug(f"Decoding JPEG at reduced size {img.width}x{img.height}")
+
+        with timer.stage("decode"):
+            img.load()
+
+        if not plan.is_identity:
+            # Crops before rotating and only renders the kept pixels
+            img = plan.scaled(img.size).apply(img, timer)
+            _LOGGER.info(f"Rotated image by {rotate_angle} degrees, crop {crop_box}")
+
+        if img.size != target_size:
+            with timer.stage("resize"):
+                img = img.resize(target_size, Image.LANCZOS)
+
+        if options["add_bar"]:
+            _LOGGER.debug("Adding text bar to image.")
+            with timer.stage("bar"):
+                img = add_text_bar(
+                    img, options["custom_text_left"], options["custom_text_middle"], options["custom_text_right"],
+                    options["setting_font_path"], options["setting_font_size"], options["setting_font_color"],
+                    options["setting_bar_height"], options["setting_bar_color"], options["setting_bar_position"], event_data
+                )
+
+        event_data["final_resolution"] = [img.width, img.height]
 
+    if encoded is not None:
+        return None, encoded
+    return img, None
+
+def process_snapshot(image_content, file_path: str, options: dict, event_data: dict,
+                     timer: StageTimer = None, publish=None):
+    """Decode, transform, encode and write a snapshot. Runs in a worker thread.
+
+    publish(data, image_format) receives the encoded bytes for the latest
+    snapshot cache.
+    """
+    timer = timer or StageTimer()
+    image_format = image_format_for(file_path)
+    img, encoded = render_snapshot(image_content, options, event_data, timer, image_format == "JPEG")
+    if img is None and encoded is None:
+        return
+
+    if encoded is None and publish:
+        encoded = encode_image(img, image_format, options["encoder"], timer)
+    if publish:
+        publish(encoded, image_format)
+    if not options.get("persist", True):
         event_data["success"] = True
+        return
 
+    if encoded is not None:
+        write_bytes(encoded, file_path, options["fsync"], timer)
+    else:
+        save_image(img, file_path, options["encoder"], options["fsync"], timer)
+    _LOGGER.info(f"Snapshot saved at {file_path}")
+
+    event_data["success"] = True
+
+def fit_size(size, max_size) -> tuple:
+    """Largest size with the aspect ratio of size that fits into max_size, never upscaled."""
+    width, height = size
+    if not max_size:
+        return width, height
+    scale = min(1.0, max_size[0] / width, max_size[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def downscale(img: Image.Image, size: tuple) -> Image.Image:
+    """Resize to size; large factors are first reduced by cheap pixel binning."""
+    factor = min(img.width // size[0], img.height // size[1]) // 2
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img.resize(size, Image.LANCZOS)
+
+def render_shared_image(image_content, outputs: list, options: dict, event_data: dict, timer: StageTimer):
+    """Decode and transform once at the size of the largest rendition. Runs in a worker thread."""
+    max_sizes = [output["max_size"] for output in outputs]
+    shared_max_size = None
+    if all(max_sizes):
+        # Every rendition fits into the largest box, so the JPEG can be drafted down to it
+        shared_max_size = [max(size[0] for size in max_sizes), max(size[1] for size in max_sizes)]
+    img, _ = render_snapshot(
+        image_content, {**options, "max_size": shared_max_size}, event_data, timer, allow_lossless=False
+    )
+    return img
+
+def write_rendition(img: Image.Image, output: dict, fsync: bool, persist: bool = True, publish=None) -> dict:
+    """Scale the shared image down to one rendition and encode it. Runs in a worker thread."""
+    timer = StageTimer()
+    result = {"file_path": output["file_path"], "format": output["format"], "success": False, "error": None}
+    try:
+        size = fit_size(img.size, output["max_size"])
+        if size != img.size:
+            with timer.stage("resize"):
+                img = downscale(img, size)
+        else:
+            # Image.save keeps the encoder settings on the image, so parallel renditions need their own
+            img = img.copy()
+        if publish:
+            data = encode_image(img, output["format"], output["encoder"], timer)
+            publish(data, output["format"])
+            if persist:
+                write_bytes(data, output["file_path"], fsync, timer)
+        elif persist:
+            save_image(img, output["file_path"], output["encoder"], fsync, timer, output["format"])
+        result["resolution"] = list(img.size)
+        result["success"] = True
     except Exception as e:
-        _LOGGER.exception(f"Error while taking snapshot: {str(e)}")
-        event_data["error"] = str(e)
+        _LOGGER.error(f"Rendition {output['file_path']} failed: {str(e)}")
+        result["error"] = str(e)
+    result["timings"] = timer.result()
+    return result
+
+async def async_write_outputs(hass: HomeAssistant, camera_entity_id: str, img: Image.Image, outputs: list,
+                              options: dict, event_data: dict, timer: StageTimer):
+    """Encode all renditions of the shared image in parallel on the image pool."""
+    latest_cache = hass.data.get(DOMAIN, {}).get("latest_cache")
+
+    def publisher(index, output):
+        if not latest_cache:
+            return None
+        return partial(latest_cache.put, camera_entity_id, output["name"], main=index == 0)
+
+    with timer.stage("outputs"):
+        results = await asyncio.gather(*(
+            async_run_image_job(
+                hass, event_data, write_rendition, img, output, options["fsync"], options["persist"],
+                publisher(index, output)
+            )
+            for index, output in enumerate(outputs)
+        ), return_exceptions=True)
+
+    event_data["outputs"] = []
+    for output, result in zip(outputs, results):
+        if isinstance(result, Exception):
+            result = {
+                "file_path": output["file_path"], "format": output["format"],
+                "success": False, "error": str(result)
+            }
+        elif latest_cache:
+            result["url"] = latest_url(camera_entity_id, output["name"])
+        event_data["outputs"].append(result)
+    if latest_cache:
+        event_data["url"] = event_data["outputs"][0].get("url")
+    failed = [result for result in event_data["outputs"] if not result["success"]]
+    if failed:
+        event_data["error"] = f"{len(failed)} of {len(outputs)} outputs failed: {failed[0]['error']}"
+        return
+
+    event_data["success"] = True
+
+async def handle_list_media(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    catalog = hass.data.get(DOMAIN, {}).get("catalog")
+    if not catalog:
+        return {"success": False, "error": "Media catalog is not available"}
+
+    start = call.data.get("start")
+    end = call.data.get("end")
+    result = await catalog.async_query(
+        camera_entity_id=call.data.get("camera_entity_id"),
+        media_type=call.data.get("media_type"),
+        start=dt_util.as_timestamp(start) if start else None,
+        end=dt_util.as_timestamp(end) if end else None,
+        limit=call.data["limit"],
+        cursor=call.data.get("cursor")
+    )
+    for item in result["items"]:
+        item["timestamp"] = dt_util.as_local(dt_util.utc_from_timestamp(item["timestamp"])).isoformat()
+    return {"success": True, **result}
+
+async def handle_record_timelapse(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    timelapse_manager = hass.data.get(DOMAIN, {}).get("timelapse_manager")
+    if not timelapse_manager:
+        return {"success": False, "error": "Advanced Snapshot is not set up"}
+
+    camera_entity_id = call.data["camera_entity_id"]
+    file_path = call.data["file_path"]
+    if not os.path.isabs(file_path):
+        file_path = os.path.join(hass.data[DOMAIN].get("snapshot_folder"), file_path)
+    session_id = call.data.get("session_id") or f"{camera_entity_id.split('.', 1)[-1]}_{int(time.time())}"
+
+    data = {key: value for key, value in call.data.items() if key not in ("session_id", "interval", "duration", "fps")}
+    session = await timelapse_manager.async_start(session_id, {
+        "camera_entity_id": camera_entity_id,
+        "file_path": file_path,
+        "interval": call.data["interval"],
+        "fps": call.data["fps"],
+        "end_time": time.time() + call.data["duration"],
+        "data": data,
+        "size": None,
+        "parts": [],
+        "frames": 0,
+    })
+    _LOGGER.info(f"Timelapse {session_id} of {camera_entity_id} running until {datetime.datetime.fromtimestamp(session.config['end_time'])}")
+    return {"success": True, **session.status()}
+
+async def handle_stop_timelapse(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    timelapse_manager = hass.data.get(DOMAIN, {}).get("timelapse_manager")
+    if not timelapse_manager:
+        return {"success": False, "error": "Advanced Snapshot is not set up"}
+
+    session_id = call.data.get("session_id")
+    camera_entity_id = call.data.get("camera_entity_id")
+    sessions = [
+        session for session in list(timelapse_manager.sessions.values())
+        if (not session_id or session.session_id == session_id)
+        and (not camera_entity_id or session.config["camera_entity_id"] == camera_entity_id)
+    ]
+    results = []
+    for session in sessions:
+        await session.async_stop(finish=True)
+        results.append({**session.status(), "running": False})
+    return {"success": bool(results), "sessions": results}
+
+async def async_capture_timelapse_frame(hass: HomeAssistant, data: dict, size):
+    """Capture one frame with the snapshot options and return ((width, height), rgb24 data)."""
+    event_data = {}
+    image_content = await async_fetch_image(hass, data["camera_entity_id"], data.get("source"), 10, event_data)
+    if image_content is None:
+        return None
+    options = build_snapshot_options(hass, data)
+    try:
+        return await async_run_image_job(
+            hass, event_data, render_timelapse_frame, image_content, options, size, event_data
+        )
+    except ImagePoolFullError as e:
+        _LOGGER.warning(f"Timelapse frame of {data['camera_entity_id']} skipped: {str(e)}")
+        return None
+
+def render_timelapse_frame(image_content, options: dict, size, event_data: dict):
+    """Render a frame like a snapshot and return it as raw RGB. Runs in a worker thread."""
+    img, _ = render_snapshot(image_content, options, event_data, StageTimer(), allow_lossless=False)
+    if img is None:
+        _LOGGER.warning(f"Timelapse frame could not be rendered: {event_data.get('error')}")
+        return None
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if size and list(img.size) != list(size):
+        img = img.resize(tuple(size), Image.LANCZOS)
+    return img.size, img.tobytes()
 
-    return event_data
-    
 async def handle_record_video(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    call_start = time.monotonic()
     camera_entity_id = call.data["camera_entity_id"]
     file_path = call.data["file_path"]
     file_path_backup = call.data.get("file_path_backup")
-    duration = min(call.data.get("duration", 40), 40)
+    duration = call.data.get("duration", 40)
+    pre_seconds = call.data.get("pre_seconds", 0)
+    priority = call.data.get("priority", "normal")
+    encoder_profile_name = call.data.get("encoder_profile", DEFAULT_ENCODER_PROFILE)
+    container = call.data.get("container", DEFAULT_CONTAINER)
     rotate_angle = call.data.get("rotate_angle")
     crop = call.data.get("crop")
     crop_aspect_ratio = call.data.get("crop_aspect_ratio")
@@ -242,6 +1019,8 @@ async def handle_record_video(hass: HomeAssistant, call: ServiceCall) -> Service
     setting_bar_height = call.data.get("setting_bar_height", "40")
     setting_bar_color = call.data.get("setting_bar_color", "white")
     setting_bar_position = call.data.get("setting_bar_position", "bottom")
+    live_timestamp = call.data.get("live_timestamp", "none")
+    live_timestamp_format = call.data.get("live_timestamp_format", "%d.%m.%y %H:%M:%S")
 
     snapshot_folder = hass.data.get(DOMAIN, {}).get("snapshot_folder")
     backup_folder = hass.data.get(DOMAIN, {}).get("backup_folder")
@@ -252,185 +1031,369 @@ async def handle_record_video(hass: HomeAssistant, call: ServiceCall) -> Service
 
     if file_path_backup and not os.path.isabs(file_path_backup):
         file_path_backup = os.path.join(backup_folder, file_path_backup)
-        backup_dir = os.path.dirname(file_path_backup)
         
     if not os.path.isabs(setting_font_path):
         setting_font_path = os.path.join(font_folder, setting_font_path)
     if not os.path.splitext(setting_font_path)[1]:
         setting_font_path += ".ttf"
     
-    stream = await async_get_stream_source(hass, camera_entity_id)
+    timer = StageTimer()
+    with timer.stage("fetch"):
+        stream = await async_get_stream_source(hass, camera_entity_id)
     if not stream:
         return {"success": False, "error": "Camera stream could not be started"}
 
-    try:
-        probe = ffmpeg.probe(stream)
-        video_stream = next(s for s in probe["streams"] if s["codec_type"] == "video")
+    probe_cache = hass.data.get(DOMAIN, {}).get("probe_cache")
+    needs_resolution = add_bar and not (crop and (len(crop) == 4 or crop_aspect_ratio))
+    stream_info = None
+    with timer.stage("probe"):
+        if probe_cache:
+            stream_info = probe_cache.get(stream)
+            if stream_info is None:
+                if needs_resolution:
+                    stream_info = await probe_cache.async_probe(stream)
+                else:
+                    probe_cache.async_refresh(stream)
+        elif needs_resolution:
+            try:
+                stream_info = await async_probe_stream(stream)
+            except Exception as e:
+                _LOGGER.warning(f"Probing stream failed: {str(e)}")
+
+    if stream_info:
         original_resolution = {
-            "width": int(video_stream["width"]),
-            "height": int(video_stream["height"])
+            "width": stream_info["width"],
+            "height": stream_info["height"]
         }
         final_resolution = original_resolution
-    except Exception:
+    else:
         original_resolution = None
         final_resolution = None
 
-    stream_input = ffmpeg.input(
-    stream, 
-    rtsp_transport='tcp',
-    timeout='5000000',
-    max_delay='500000'
-    )
-    video = stream_input.video
-
-    if rotate_angle:
-            rotation_angle_rad = math.radians(rotate_angle)
-            video = video.filter('rotate', rotation_angle_rad, fillcolor='black')
-            _LOGGER.info(f"Rotated image by {rotate_angle} degrees")
-    
-    setting_font_color = sanitize_ffmpeg_color(setting_font_color)
-    setting_bar_color = sanitize_ffmpeg_color(setting_bar_color)
-
-    # CROP
-    if crop and len(crop) >= 3:
-        x, y, w = crop[:3]
-        h = crop[3] if len(crop) == 4 else None
-        if crop_aspect_ratio and not h:
-            try:
-                aspect_w, aspect_h = map(int, crop_aspect_ratio.split(":"))
-                h = int(w * aspect_h / aspect_w)
-            except:
-                return {"success": False, "error": "Invalid aspect ratio format"}
-        if h:
-            video = video.crop(x=x, y=y, width=w, height=h)
-            final_resolution = {"width": w, "height": h}
-
-    # BAR + TEXT
-    if add_bar and final_resolution:
-        now = datetime.datetime.now().strftime("%d.%m.%y %H:%M:%S")
-
-        try:
-            if isinstance(setting_bar_height, str) and "%" in setting_bar_height:
-                percent = float(setting_bar_height.strip("%")) / 100.0
-                bar_height_px = int(final_resolution["height"] * percent)
-            else:
-                bar_height_px = int(setting_bar_height)
-        except:
-            bar_height_px = 80
-
-        bar_y = final_resolution["height"] - bar_height_px if setting_bar_position == "bottom" else 0
-        text_y = f"({bar_height_px}-text_h)/2 + {bar_y}"
-
-        if setting_font_size == "auto":
-            setting_font_size = max(10, int(bar_height_px * 0.5))
+    try:
+        plan = plan_geometry(
+            (stream_info["width"], stream_info["height"]) if stream_info else None,
+            rotate_angle, crop, crop_aspect_ratio
+        )
+    except GeometryError as e:
+        return {"success": False, "error": str(e)}
+
+    prerecord = hass.data.get(DOMAIN, {}).get("prerecord_buffers", {}).get(camera_entity_id)
+    clip_dir = None
+    segments = None
+    prerecord_error = None
+    if pre_seconds:
+        # Checked before waiting, so a stalled buffer does not delay the clip by its whole length
+        if not prerecord:
+            prerecord_error = "No pre-record buffer configured for this camera"
+        elif not await hass.async_add_executor_job(prerecord.is_healthy):
+            prerecord_error = "Pre-record buffer is not recording"
         else:
-            setting_font_size = int(setting_font_size)
-        
-        custom_text_left = utf8_drawtext(custom_text_left)
-        custom_text_middle = utf8_drawtext(custom_text_middle)
-        custom_text_right = utf8_drawtext(custom_text_right)
-       
-        video = video.drawbox(
-            x=0,
-            y=bar_y,
-            width="iw",
-            height=bar_height_px,
-            color=f"{setting_bar_color}",
-            t="fill"
+            pre_seconds = min(pre_seconds, prerecord.seconds)
+            with timer.stage("capture"):
+                clip_dir, segments, offset, clip_start = await prerecord.async_capture(pre_seconds, duration)
+            if not segments:
+                prerecord_error = "Pre-record buffer delivered no segments"
+        if prerecord_error:
+            _LOGGER.warning(f"{prerecord_error} for {camera_entity_id}, recording from now on")
+
+    ingest_manager = hass.data.get(DOMAIN, {}).get("ingest_manager")
+    consumer = None
+    if segments:
+        list_path = await hass.async_add_executor_job(
+            write_concat_list, os.path.join(clip_dir, "segments.txt"), segments
         )
+        stream_input = ffmpeg.input(list_path, format="concat", safe=0, ss=offset)
+        duration = pre_seconds + duration
+    else:
+        # Recording straight from the camera is limited to 40 seconds
+        duration = min(duration, 40)
+        pre_seconds = 0
+        if ingest_manager:
+            with timer.stage("fetch"):
+                consumer = await ingest_manager.async_acquire(camera_entity_id)
+        if consumer:
+            stream_input = ffmpeg.input("pipe:0", format="mpegts")
+        else:
+            stream_input = ffmpeg.input(
+            stream, 
+            rtsp_transport='tcp',
+            timeout='5000000',
+            max_delay='500000'
+            )
 
-        video = video.drawtext(
-            text=custom_text_left,
-            x=10,
-            y=text_y,
-            fontsize=setting_font_size,
-            fontcolor=setting_font_color,
-            fontfile=setting_font_path
-        )
+    if (segments or consumer) and stream_info:
+        # Buffer and shared ingest deliver MPEG-TS, which may have converted the audio
+        stream_info = {**stream_info, "audio_codec": ingest_audio_codec(stream_info.get("audio_codec"))}
+    source_video = video = stream_input.video
 
-        video = video.drawtext(
-            text=custom_text_middle,
-            x="(w-text_w)/2",
-            y=text_y,
-            fontsize=setting_font_size,
-            fontcolor=setting_font_color,
-            fontfile=setting_font_path
-        )
+    # ROTATE + CROP: same result as for snapshots, cropped first where possible
+    if not plan.is_identity:
+        video = plan.apply_ffmpeg(video)
+        _LOGGER.info(f"Rotated video by {rotate_angle} degrees, crop {plan.crop_box}")
+        if plan.output_size:
+            final_resolution = {"width": plan.output_size[0], "height": plan.output_size[1]}
 
-        video = video.drawtext(
-            text=custom_text_right,
-            x="w-text_w-10",
-            y=text_y,
-            fontsize=setting_font_size,
-            fontcolor=setting_font_color,
-            fontfile=setting_font_path
+    # BAR + TEXT: rendered once by PIL like the snapshot bar and overlaid on every frame
+    bar = None
+    if add_bar and final_resolution:
+        texts = {"left": custom_text_left, "middle": custom_text_middle, "right": custom_text_right}
+        if live_timestamp != "none":
+            texts[live_timestamp] = ""
+        bar = await hass.async_add_executor_job(
+            write_video_bar, final_resolution["width"], final_resolution["height"],
+            (texts["left"], texts["middle"], texts["right"]), setting_font_path, setting_font_size,
+            setting_font_color, setting_bar_height, setting_bar_color, setting_bar_position
         )
+        video = ffmpeg.overlay(video, ffmpeg.input(bar["path"]), x=0, y=bar["y"])
+
+        if live_timestamp != "none":
+            # Only the timestamp changes per frame; drawtext renders just this one field
+            x = {"left": TEXT_MARGIN, "middle": "(w-text_w)/2", "right": f"w-text_w-{TEXT_MARGIN}"}[live_timestamp]
+            drawtext_args = {"fontfile": setting_font_path} if bar["font_exists"] else {}
+            video = video.drawtext(
+                text=live_timestamp_text(clip_start if segments else None, live_timestamp_format),
+                x=x,
+                y=bar["text_y"],
+                fontsize=bar["font_size"],
+                fontcolor=sanitize_ffmpeg_color(setting_font_color),
+                escape_text=False,
+                **drawtext_args
+            )
 
-    output_stream = ffmpeg.output(
-        video,
-        file_path,
-        t=duration,
-        vcodec="libx264",
-        acodec="aac",
-        crf=18,
-        preset="medium",
-        tune="film",          
-        pix_fmt="yuv420p",
-        format="mp4"
-    )
+    video_codec = stream_info.get("video_codec") if stream_info else None
+    audio_codec = stream_info.get("audio_codec") if stream_info else None
+    if video is source_video and video_codec in MP4_VIDEO_CODECS:
+        modes = ["passthrough", "encode"]
+    else:
+        modes = ["encode"]
+        if video is source_video:
+            _LOGGER.info(f"Stream codec {video_codec} cannot be copied into MP4, encoding instead")
 
-    try:
-        process = ffmpeg.run_async(
-            output_stream,
-            overwrite_output=True,
-            pipe_stderr=True,
-            pipe_stdout=True,
-        )
-    
-        # communicate() is a blocking call, so it's run in an executor
-        stdout, stderr = await hass.async_add_executor_job(process.communicate)
-    
-        if process.returncode != 0:
-            err_txt = (stderr or b"").decode("utf-8", errors="ignore")
-            return {
-                "success": False,
-                "error": f"FFmpeg failed (rc={process.returncode}): {err_txt}"
-            }
+    available = {}
+    playlist_checks = set()
 
-    except ffmpeg.Error as e:
-        return {
-            "success": False,
-            "error": f"FFmpeg execution error: {e.stderr.decode('utf-8', errors='ignore') if e.stderr else str(e)}"
-        }
-    except OSError as e:
-        _LOGGER.error(f"OS error during FFmpeg execution: {str(e)}")
-        return {
-            "success": False,
-            "error": f"OS error during FFmpeg execution: {str(e)}"
-        }
+    @callback
+    def set_available():
+        if not available:
+            available["after"] = round(time.monotonic() - call_start, 3)
+            fire_record_available(hass, camera_entity_id, file_path, container)
 
-    if file_path_backup:
+    async def async_check_playlist():
         try:
-            await hass.async_add_executor_job(partial(os.makedirs, backup_dir, exist_ok=True))
-
-            # Use shutil.copy2 for a cleaner copy operation (also in the Executor)
-            await hass.async_add_executor_job(shutil.copy2, file_path, file_path_backup)
+            if await hass.async_add_executor_job(playlist_exists, file_path):
+                set_available()
+        finally:
+            playlist_checks.clear()
+
+    @callback
+    def on_progress(mode, progress):
+        fire_record_progress(hass, camera_entity_id, file_path, mode, duration, progress)
+        if available or playlist_checks or not is_available(container, progress):
+            return
+        if container == "hls":
+            # One check at a time in the executor, the callback runs on the event loop
+            playlist_checks.add(hass.async_create_task(async_check_playlist()))
+        else:
+            set_available()
+
+    output_resolution = [final_resolution["width"], final_resolution["height"]] if final_resolution else None
+    encoder_tuner = hass.data.get(DOMAIN, {}).get("encoder_tuner")
+    auto_preset = None
+    if encoder_profile_name == "auto" and encoder_tuner:
+        auto_preset = encoder_tuner.choose(camera_entity_id, output_resolution)
+        _LOGGER.info(f"Encoder preset {auto_preset} chosen for {camera_entity_id} at {output_resolution}")
+    encoder = encoder_profile(encoder_profile_name, auto_preset)
+
+    scheduler = hass.data.get(DOMAIN, {}).get("recording_scheduler")
+    slot = None
+    try:
+        for mode in modes:
+            if mode == "encode" and scheduler:
+                slot_context = scheduler.async_slot(priority, encoder["preset"])
+            else:
+                slot_context = contextlib.nullcontext()
+            try:
+                async with slot_context as slot:
+                    if slot:
+                        timer.add("queue", slot.wait_time)
+                    if slot and slot.wait_time and consumer:
+                        # Start the clip when the slot became free, not with the data queued meanwhile
+                        consumer.flush()
+                    await hass.async_add_executor_job(remove_container_files, file_path, container)
+                    if mode == "passthrough":
+                        streams = [source_video]
+                        output_args = {"vcodec": "copy"}
+                        if video_codec == "hevc":
+                            # Apple players need the hvc1 tag for H.265 in MP4
+                            output_args["tag:v"] = "hvc1"
+                        if audio_codec:
+                            streams.append(stream_input.audio)
+                            output_args["acodec"] = "copy" if audio_codec in MP4_AUDIO_CODECS else "aac"
+                        output_stream = ffmpeg.output(
+                            *streams,
+                            file_path,
+                            t=duration,
+                            **container_args(container, file_path, encode=False),
+                            **output_args
+                        )
+                    else:
+                        output_stream = ffmpeg.output(
+                            video,
+                            file_path,
+                            t=duration,
+                            vcodec="libx264",
+                            acodec="aac",
+                            crf=encoder["crf"],
+                            preset=slot.preset if slot else encoder["preset"],
+                            tune=encoder["tune"],
+                            pix_fmt="yuv420p",
+                            **container_args(container, file_path, encode=True)
+                        )
+                    output_stream = output_stream.global_args("-benchmark")
+
+                    process = FFmpegProcess(
+                        hass,
+                        ffmpeg.compile(output_stream, overwrite_output=True),
+                        consumer=consumer,
+                        on_progress=partial(on_progress, mode),
+                        timeout=duration * 2 + RECORD_TIMEOUT_MARGIN
+                    )
+                    with timer.stage("ffmpeg"):
+                        await process.async_run()
+        
+                if process.returncode != 0:
+                    err_txt = process.stderr
+                    if mode == "passthrough":
+                        _LOGGER.warning(f"Stream copy failed (rc={process.returncode}), falling back to encoding: {err_txt[-500:]}")
+                        continue
+                    if probe_cache:
+                        # The cached stream info may be outdated, e.g. after a camera reconfiguration
+                        probe_cache.invalidate(stream)
+                        probe_cache.async_refresh(stream)
+                    return {
+                        "success": False,
+                        "error": f"FFmpeg failed (rc={process.returncode}): {err_txt}"
+                    }
+
+            except (RecordingQueueFullError, FFmpegTimeoutError) as e:
+                return {
+                    "success": False,
+                    "error": str(e)
+                }
+            except OSError as e:
+                _LOGGER.error(f"OS error during FFmpeg execution: {str(e)}")
+                return {
+                    "success": False,
+                    "error": f"OS error during FFmpeg execution: {str(e)}"
+                }
+            break
+    finally:
+        if consumer:
+            consumer.release()
+        if clip_dir:
+            await hass.async_add_executor_job(shutil.rmtree, clip_dir, True)
+        if bar:
+            await hass.async_add_executor_job(partial(os.remove, bar["path"]))
+
+    cpu_usage = parse_ffmpeg_benchmark(process.stderr)
+    _LOGGER.info(f"Recorded {file_path} in {mode} mode, cpu usage: {cpu_usage}")
+
+    preset = None
+    encode_speed = None
+    if mode == "encode":
+        preset = slot.preset if slot else encoder["preset"]
+        encode_speed = realtime_factor(
+            process.progress, cpu_usage, live=not segments, slots=scheduler.max_running if scheduler else 1
+        )
+        if encode_speed and encoder_tuner:
+            encoder_tuner.record(camera_entity_id, output_resolution, preset, encode_speed)
 
-        except Exception as e:
-            return {
-                "success": False,
-                "error": f"Backup failed: {str(e)}"
-            }
+    files = await hass.async_add_executor_job(container_files, file_path, container)
+    if file_path_backup:
+        # Segments of HLS go next to the backup playlist, which refers to them by name
+        backups = [os.path.join(os.path.dirname(file_path_backup), os.path.basename(path)) for path in files[:-1]]
+        for path, backup_path in zip(files, [*backups, file_path_backup]):
+            error = await async_queue_backup(hass, camera_entity_id, path, backup_path, timer)
+            if error:
+                return {"success": False, "error": error}
+        backup_state = "queued"
+    else:
+        backup_state = None
+
+    timings = timer.result()
+    timing_stats = hass.data.get(DOMAIN, {}).get("timing_stats")
+    if timing_stats:
+        timing_stats.add(camera_entity_id, "video", timings)
+    register_media(
+        hass, camera_entity_id, "video", file_path, file_path_backup,
+        [final_resolution["width"], final_resolution["height"]] if final_resolution else None,
+        media_options_of(call.data)
+    )
+    retention = hass.data.get(DOMAIN, {}).get("retention")
+    if retention:
+        for path in files[:-1]:
+            retention.track(path, camera_entity_id)
 
     return {
         "success": True,
         "file_path": file_path,
         "backup_path": file_path_backup,
+        "backup": backup_state,
+        "container": container,
+        "url": local_url(hass.config.path("www"), file_path),
+        "available_after": available.get("after"),
         "original_resolution": original_resolution,
-        "final_resolution": final_resolution
+        "final_resolution": final_resolution,
+        "mode": mode,
+        "cpu_usage": cpu_usage,
+        "pre_seconds": pre_seconds,
+        "prerecord_error": prerecord_error,
+        "shared_ingest": consumer is not None,
+        "bytes_written": process.progress.get("bytes_written"),
+        "priority": priority,
+        "queue_wait": round(slot.wait_time, 3) if slot else 0,
+        "encoder_profile": encoder_profile_name if mode == "encode" else None,
+        "preset": preset,
+        "encode_speed": round(encode_speed, 3) if encode_speed else None,
+        "timings": timings
     }
 
 
+@callback
+def fire_record_available(hass: HomeAssistant, camera_entity_id: str, file_path: str, container: str):
+    """Tell that a fragmented recording can already be played."""
+    hass.bus.async_fire(f"{DOMAIN}_record_available", {
+        "camera_entity_id": camera_entity_id,
+        "file_path": file_path,
+        "container": container,
+        "url": local_url(hass.config.path("www"), file_path),
+    })
+
+@callback
+def fire_record_progress(hass: HomeAssistant, camera_entity_id: str, file_path: str,
+                         mode: str, duration: int, progress: dict):
+    hass.bus.async_fire(f"{DOMAIN}_record_progress", {
+        "camera_entity_id": camera_entity_id,
+        "file_path": file_path,
+        "mode": mode,
+        "duration": duration,
+        **progress
+    })
+
+
+def parse_ffmpeg_benchmark(stderr: str):
+    """Read the CPU time reported by ffmpeg -benchmark."""
+    match = re.search(r"bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s", stderr)
+    if not match:
+        return None
+    utime, stime, rtime = (float(value) for value in match.groups())
+    return {
+        "cpu_time": round(utime + stime, 3),
+        "real_time": round(rtime, 3),
+        "cpu_load": round((utime + stime) / rtime, 3) if rtime else None
+    }
+
 def sanitize_ffmpeg_color(color_str):
     color_str = color_str.strip().lower()
     if color_str.startswith("rgb(") and color_str.endswith(")"):
@@ -439,23 +1402,6 @@ def sanitize_ffmpeg_color(color_str):
     return color_str  
 
     
-def utf8_drawtext(text: str) -> str:
-    special_chars = {
-        "°": "\\u00B0C",
-        "ä": "\\u00E4",
-        "ö": "\\u00F6",
-        "ü": "\\u00FC",
-        "Ä": "\\u00C4",
-        "Ö": "\\u00D6",
-        "Ü": "\\u00DC",
-        "ß": "\\u00DF"
-    }
-
-    for char, unicode_escape in special_chars.items():
-        text = text.replace(char, unicode_escape)
-
-    return text.encode('utf-8').decode('unicode_escape')
-    
 def add_text_bar_old(img: Image.Image, custom_text_left: str, custom_text_middle: str,
                  custom_text_right: str, setting_font_path: str, setting_font_size,
                  setting_font_color: str, setting_bar_height,
@@ -506,13 +1452,11 @@ def add_text_bar_old(img: Image.Image, custom_text_left: str, custom_text_middle
 
     return new_img
 
-def add_text_bar(img: Image.Image, custom_text_left: str, custom_text_middle: str,
-                 custom_text_right: str, setting_font_path: str, setting_font_size,
-                 setting_font_color: str, setting_bar_height,
-                 setting_bar_color: str, setting_bar_position: str, event_data: dict) -> Image.Image:
-
-    width, height = img.size
-
+def render_text_bar(width: int, height: int, custom_text_left: str, custom_text_middle: str,
+                    custom_text_right: str, setting_font_path: str, setting_font_size,
+                    setting_font_color: str, setting_bar_height,
+                    setting_bar_color: str, setting_bar_position: str, event_data: dict):
+    """Return (bar, bar_y, font_size) for an image of width x height. The bar is an RGBA image."""
     if isinstance(setting_bar_height, str) and setting_bar_height.endswith('%'):
         try:
             percentage = float(setting_bar_height.strip('%')) / 100.0
@@ -532,51 +1476,67 @@ def add_text_bar(img: Image.Image, custom_text_left: str, custom_text_middle: st
     if setting_font_size == "auto":
         setting_font_size = max(10, int(bar_height * 0.5))
 
-    draw = ImageDraw.Draw(img)
-
-    try:
-        font = ImageFont.truetype(setting_font_path, setting_font_size)
-    except IOError:
-        _LOGGER.warning(f"Font file not found: {setting_font_path}, using default font.")
-        event_data["error"] = f"Font file not found: {setting_font_path}, using default font."
-        font = ImageFont.load_default()
-
-    # Draw bar background
-    if setting_bar_position == "top":
-        bar_rect = (0, 0, width, bar_height)
-        text_y = (bar_height - setting_font_size) // 2
-    else:
-        bar_rect = (0, height - bar_height, width, height)
-        text_y = height - bar_height + (bar_height - setting_font_size) // 2
+    bar, font_error = get_bar_template(
+        width, bar_height, setting_bar_position, setting_bar_color, setting_font_color,
+        setting_font_path, setting_font_size, custom_text_left, custom_text_middle, custom_text_right
+    )
+    if font_error:
+        event_data["error"] = font_error
 
-    draw.rectangle(bar_rect, fill=setting_bar_color)
+    bar_y = 0 if setting_bar_position == "top" else height - bar_height
+    return bar, bar_y, setting_font_size
 
-    margin = 10
+def add_text_bar(img: Image.Image, custom_text_left: str, custom_text_middle: str,
+                 custom_text_right: str, setting_font_path: str, setting_font_size,
+                 setting_font_color: str, setting_bar_height,
+                 setting_bar_color: str, setting_bar_position: str, event_data: dict) -> Image.Image:
 
-    if custom_text_left:
-        draw.text((margin, text_y), custom_text_left, fill=setting_font_color, font=font)
+    bar, bar_y, _ = render_text_bar(
+        img.width, img.height, custom_text_left, custom_text_middle, custom_text_right,
+        setting_font_path, setting_font_size, setting_font_color, setting_bar_height,
+        setting_bar_color, setting_bar_position, event_data
+    )
 
-    if custom_text_middle:
-        text_middle_width = draw.textlength(custom_text_middle, font=font)
-        draw.text(((width - text_middle_width) // 2, text_y),
-                  custom_text_middle, fill=setting_font_color, font=font)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
 
-    if custom_text_right:
-        text_right_width = draw.textlength(custom_text_right, font=font)
-        draw.text((width - text_right_width - margin, text_y),
-                  custom_text_right, fill=setting_font_color, font=font)
+    img.paste(bar, (0, bar_y), bar)
+    event_data["overlay_cache"] = cache_stats()
 
     return img
 
-async def async_save_image(img: Image.Image, file_path: str):
-    ext = os.path.splitext(file_path)[1].lower()
-    format_map = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}
-    image_format = format_map.get(ext, "JPEG")
-
-    async with aiofiles.open(file_path, "wb") as f:
-        buffer = BytesIO()
-        img.save(buffer, format=image_format)
-        buffer.seek(0)
-        await f.write(buffer.getvalue())
+def write_video_bar(width: int, height: int, texts: tuple, setting_font_path: str, setting_font_size,
+                    setting_font_color: str, setting_bar_height, setting_bar_color: str,
+                    setting_bar_position: str) -> dict:
+    """Render the bar like add_text_bar into a temporary RGBA PNG for ffmpeg's overlay filter."""
+    event_data = {}
+    bar, bar_y, font_size = render_text_bar(
+        width, height, *texts, setting_font_path, setting_font_size, setting_font_color,
+        setting_bar_height, setting_bar_color, setting_bar_position, event_data
+    )
+    fd, bar_path = tempfile.mkstemp(prefix="advanced_snapshot_bar_", suffix=".png")
+    with os.fdopen(fd, "wb") as f:
+        bar.save(f, format="PNG", compress_level=1)
+    # A top bar is one row taller than its height, see get_bar_template
+    bar_height = bar.height - 1 if setting_bar_position == "top" else bar.height
+    return {
+        "path": bar_path,
+        "y": bar_y,
+        "text_y": bar_y + (bar_height - font_size) // 2,
+        "font_size": font_size,
+        "font_exists": os.path.isfile(setting_font_path),
+        "error": event_data.get("error"),
+    }
 
-    _LOGGER.info(f"Snapshot saved: {file_path} ({image_format})")
+def live_timestamp_text(start, time_format: str) -> str:
+    """drawtext text showing the wall-clock time of each frame.
+
+    With start, the time is counted from the frame timestamps, which is
+    right for clips from the pre-record buffer; otherwise the time of
+    encoding is shown, which matches for live input.
+    """
+    # Escaped for drawtext's own parser; ffmpeg-python escapes the filter levels
+    time_format = time_format.replace("\\", "\\\\").replace(":", "\\:").replace("}", "\\}")
+    if start is None:
+        return f"%{{localtime:{time_format}}}"
+    return f"%{{pts:localtime:{round(start)}:{time_format}}}"
@@ -0,0 +1,232 @@
+import asyncio
+import errno
+import logging
+import os
+import shutil
+import time
+import uuid
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+from .const import DOMAIN
+from .storage import atomic_write, ensure_dir
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY = "advanced_snapshot.backup_queue"
+STORAGE_VERSION = 1
+SAVE_DELAY = 1
+
+# Retries after 5 s, 10 s, 20 s ... up to one hour apart, about a day in total
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 3600
+MAX_ATTEMPTS = 30
+
+# Errors where a hardlink is impossible and the file has to be copied
+_LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EACCES, errno.EMLINK, errno.ENOTSUP, errno.ENOSYS)
+
+
+class BackupQueue:
+    """Copies finished files to their backup path in the background.
+
+    async_enqueue pins the content of the file right away with a hardlink
+    in the spool folder (or a local copy where links are not possible),
+    so the file may be overwritten by the next call while its backup is
+    still waiting. The backup is then written by a single worker, as a
+    hardlink if spool and backup share a filesystem, otherwise with
+    copy_file_range. Failed backups are retried with exponential backoff.
+    The queue is kept in a Store and resumed after a restart.
+
+    Every finished, retried or abandoned backup fires an
+    ``advanced_snapshot_backup`` event.
+    """
+
+    def __init__(self, hass: HomeAssistant, spool_folder: str, on_done=None):
+        self.hass = hass
+        self.spool_folder = spool_folder
+        self.on_done = on_done
+        self.done = 0
+        self.failed = 0
+        self._jobs = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._jobs), "done": self.done, "failed": self.failed}
+
+    async def async_load(self):
+        data = await self._store.async_load() or {}
+        self._jobs = data.get("jobs", [])
+        if self._jobs:
+            _LOGGER.info(f"Backup queue: {len(self._jobs)} backups pending from the last run")
+
+    def start(self):
+        self._task = self.hass.async_create_background_task(
+            self._async_run(), "advanced_snapshot.backup_queue"
+        )
+
+    async def async_stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self._store.async_save(self._data())
+
+    async def async_enqueue(self, camera_entity_id: str, file_path: str, backup_path: str):
+        """Queue a backup of file_path; returns an error message if the file could not be spooled."""
+        spool_path = os.path.join(
+            self.spool_folder, uuid.uuid4().hex + os.path.splitext(file_path)[1]
+        )
+        try:
+            await self.hass.async_add_executor_job(_spool, file_path, spool_path)
+        except OSError as e:
+            _LOGGER.error(f"Backup of {file_path} could not be queued: {str(e)}")
+            return str(e)
+
+        self._jobs.append({
+            "camera_entity_id": camera_entity_id,
+            "file_path": file_path,
+            "backup_path": backup_path,
+            "spool_path": spool_path,
+            "queued": time.time(),
+            "attempts": 0,
+            "next_attempt": 0,
+        })
+        self._save()
+        self._wakeup.set()
+        return None
+
+    @callback
+    def _save(self):
+        self._store.async_delay_save(self._data, SAVE_DELAY)
+
+    def _data(self) -> dict:
+        return {"jobs": self._jobs}
+
+    async def _async_run(self):
+        while True:
+            now = time.time()
+            due = [job for job in self._jobs if job["next_attempt"] <= now]
+            if not due:
+                self._wakeup.clear()
+                next_attempt = min((job["next_attempt"] for job in self._jobs), default=None)
+                timeout = next_attempt - now if next_attempt else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for job in due:
+                await self._async_transfer(job)
+
+    async def _async_transfer(self, job: dict):
+        start = time.monotonic()
+        job["attempts"] += 1
+        try:
+            method = await self.hass.async_add_executor_job(_transfer, job["spool_path"], job["backup_path"])
+        except OSError as e:
+            spool_lost = not await self.hass.async_add_executor_job(os.path.exists, job["spool_path"])
+            if job["attempts"] >= MAX_ATTEMPTS or spool_lost:
+                _LOGGER.error(f"Backup of {job['file_path']} failed {job['attempts']} times, giving up: {str(e)}")
+                self.failed += 1
+                self._finish(job, "failed", str(e))
+                await self.hass.async_add_executor_job(_remove, job["spool_path"])
+            else:
+                delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (job["attempts"] - 1))
+                _LOGGER.warning(
+                    f"Backup of {job['file_path']} failed, retrying in {delay}s: {str(e)}"
+                )
+                job["next_attempt"] = time.time() + delay
+                self._fire(job, "retrying", str(e))
+                self._save()
+            return
+
+        _LOGGER.info(f"Backup saved at {job['backup_path']} ({method})")
+        self.done += 1
+        self._finish(job, "done", None, method, time.monotonic() - start)
+        if self.on_done:
+            self.on_done(job["camera_entity_id"], job["backup_path"])
+
+    @callback
+    def _finish(self, job: dict, state: str, error: str, method: str = None, duration: float = None):
+        self._jobs.remove(job)
+        self._save()
+        self._fire(job, state, error, method, duration)
+
+    @callback
+    def _fire(self, job: dict, state: str, error: str, method: str = None, duration: float = None):
+        self.hass.bus.async_fire(f"{DOMAIN}_backup", {
+            "camera_entity_id": job["camera_entity_id"],
+            "file_path": job["file_path"],
+            "backup_path": job["backup_path"],
+            "state": state,
+            "attempts": job["attempts"],
+            "method": method,
+            "delay": round(time.time() - job["queued"], 3),
+            "duration": round(duration, 3) if duration is not None else None,
+            "error": error,
+        })
+
+
+def _spool(file_path: str, spool_path: str):
+    ensure_dir(os.path.dirname(spool_path))
+    try:
+        os.link(file_path, spool_path)
+    except OSError as e:
+        if e.errno not in _LINK_ERRORS:
+            raise
+        shutil.copyfile(file_path, spool_path)
+
+
+def _transfer(spool_path: str, backup_path: str) -> str:
+    """Write the spooled file to backup_path atomically; returns how it was written."""
+    directory = os.path.dirname(backup_path)
+    # Not cached like ensure_dir, a network share may lose its folders
+    os.makedirs(directory, exist_ok=True)
+    link_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+    try:
+        os.link(spool_path, link_path)
+    except OSError as e:
+        if e.errno not in _LINK_ERRORS:
+            raise
+    else:
+        try:
+            os.replace(link_path, backup_path)
+        except OSError:
+            _remove(link_path)
+            raise
+        _remove(spool_path)
+        return "hardlink"
+
+    with open(spool_path, "rb") as source:
+        atomic_write(backup_path, lambda f: _copy_data(source, f))
+    _remove(spool_path)
+    return "copy"
+
+
+def _copy_data(source, target):
+    """Copy in the kernel where possible, so the data does not pass through Python."""
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range:
+        try:
+            while copy_file_range(source.fileno(), target.fileno(), 16 * 1024 * 1024):
+                pass
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            # Start over with a plain copy
+            source.seek(0)
+            target.seek(0)
+            target.truncate()
+    shutil.copyfileobj(source, target, 1024 * 1024)
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from homeassistant.core import HomeAssistant, callback
+
+_LOGGER = logging.getLogger(__name__)
+
+# Entries are written together once per FLUSH_DELAY or once FLUSH_SIZE are pending
+FLUSH_DELAY = 2
+FLUSH_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    camera_entity_id TEXT,
+    media_type TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    file_path TEXT NOT NULL UNIQUE,
+    backup_path TEXT,
+    width INTEGER,
+    height INTEGER,
+    size INTEGER,
+    options TEXT
+);
+CREATE INDEX IF NOT EXISTS media_camera ON media (camera_entity_id, media_type, id);
+CREATE INDEX IF NOT EXISTS media_timestamp ON media (timestamp);
+"""
+
+COLUMNS = (
+    "id", "camera_entity_id", "media_type", "timestamp", "file_path", "backup_path",
+    "width", "height", "size", "options"
+)
+
+
+class MediaCatalog:
+    """SQLite index of the snapshots and videos written by the integration.
+
+    The capture path only appends to an in-memory list; entries are
+    written in one transaction per batch on the catalog's own thread, which
+    also owns the connection. A file path is indexed once, so a snapshot
+    that overwrites its file replaces the entry. Queries page through the
+    index newest first and never touch the media folders.
+    """
+
+    def __init__(self, hass: HomeAssistant, db_path: str):
+        self.hass = hass
+        self.db_path = db_path
+        self._connection = None
+        self._pending = []
+        self._flush_handle = None
+        self._flush_task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="advanced_snapshot_catalog")
+
+    async def async_setup(self):
+        await self._async_run(self._open)
+
+    async def async_close(self):
+        await self.async_flush()
+        await self._async_run(self._close)
+        self._executor.shutdown(wait=False)
+
+    @callback
+    def add(self, camera_entity_id: str, media_type: str, file_path: str, backup_path: str = None,
+            resolution=None, options: dict = None):
+        """Queue an entry for a file that has just been written."""
+        width, height = resolution if resolution else (None, None)
+        self._pending.append((
+            camera_entity_id, media_type, time.time(), os.path.abspath(file_path),
+            backup_path, width, height, json.dumps(options or {}, default=str)
+        ))
+        if len(self._pending) >= FLUSH_SIZE:
+            self._schedule_flush(0)
+        elif self._flush_handle is None:
+            self._schedule_flush(FLUSH_DELAY)
+
+    @callback
+    def remove(self, file_paths: list):
+        """Drop the entries of deleted files."""
+        if file_paths:
+            self._pending.append(("remove", list(file_paths)))
+            if self._flush_handle is None:
+                self._schedule_flush(FLUSH_DELAY)
+
+    async def async_flush(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if pending:
+            try:
+                await self._async_run(self._write, pending)
+            except sqlite3.Error as e:
+                _LOGGER.error(f"Media catalog: writing {len(pending)} entries failed: {str(e)}")
+
+    async def async_query(self, camera_entity_id: str = None, media_type: str = None, start: float = None,
+                          end: float = None, limit: int = 50, cursor: int = None) -> dict:
+        """Return up to limit entries, newest first, and the cursor of the next page."""
+        await self.async_flush()
+        rows = await self._async_run(
+            self._query, camera_entity_id, media_type, start, end, limit + 1, cursor
+        )
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        return {"items": rows[:limit], "next_cursor": next_cursor}
+
+    @callback
+    def _schedule_flush(self, delay: float):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+        self._flush_handle = self.hass.loop.call_later(delay, self._start_flush)
+
+    @callback
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = self.hass.async_create_background_task(
+            self.async_flush(), "advanced_snapshot.catalog_flush"
+        )
+
+    async def _async_run(self, func, *args):
+        return await self.hass.loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def _close(self):
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    def _write(self, pending: list):
+        with self._connection:
+            for entry in pending:
+                if entry[0] == "remove":
+                    self._connection.executemany(
+                        "DELETE FROM media WHERE file_path = ?", [(path,) for path in entry[1]]
+                    )
+                    continue
+                try:
+                    size = os.path.getsize(entry[3])
+                except OSError:
+                    size = None
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO media (camera_entity_id, media_type, timestamp, file_path, "
+                    "backup_path, width, height, size, options) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*entry[:7], size, entry[7])
+                )
+
+    def _query(self, camera_entity_id, media_type, start, end, limit, cursor) -> list:
+        conditions = []
+        params = []
+        for condition, value in (
+            ("camera_entity_id = ?", camera_entity_id), ("media_type = ?", media_type),
+            ("timestamp >= ?", start), ("timestamp < ?", end), ("id < ?", cursor),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM media {where} ORDER BY id DESC LIMIT ?", (*params, limit)
+        ).fetchall()
+        return [_row_to_item(row) for row in rows]
+
+
+def _row_to_item(row) -> dict:
+    return {
+        "id": row["id"],
+        "camera_entity_id": row["camera_entity_id"],
+        "media_type": row["media_type"],
+        "timestamp": row["timestamp"],
+        "file_path": row["file_path"],
+        "backup_path": row["backup_path"],
+        "resolution": [row["width"], row["height"]] if row["width"] else None,
+        "size": row["size"],
+        "options": json.loads(row["options"]) if row["options"] else {},
+    }
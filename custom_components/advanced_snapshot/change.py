@@ -0,0 +1,81 @@
+import logging
+import math
+from io import BytesIO
+from PIL import Image, ImageChops
+from .geometry import GeometryError, plan_geometry
+from .overlay import LRUCache
+
+_LOGGER = logging.getLogger(__name__)
+
+FINGERPRINT_SIZE = (32, 32)
+# The difference is averaged per block, so a small moving object still counts
+BLOCKS = (8, 8)
+# Fingerprints kept, one per camera and file path
+MAX_FINGERPRINTS = 256
+
+
+def fingerprint(image_content, rotate_angle=None, crop=None, crop_aspect_ratio=None) -> Image.Image:
+    """Small grayscale thumbnail of the part of a frame a snapshot keeps. Blocking.
+
+    Only the source region of the crop is compared, so a change inside a
+    small crop is not diluted by the rest of the frame. JPEG data is
+    decoded from the luma channel only, at the smallest scale that still
+    leaves the region four pixels per thumbnail pixel.
+    """
+    if isinstance(image_content, Image.Image):
+        img = image_content
+    else:
+        img = Image.open(BytesIO(image_content))
+    original_width, original_height = img.size
+    region = _source_region(img.size, rotate_angle, crop, crop_aspect_ratio)
+    if img.format == "JPEG":
+        region_width, region_height = (region[2] - region[0], region[3] - region[1]) if region else img.size
+        img.draft("L", (
+            math.ceil(original_width * FINGERPRINT_SIZE[0] * 4 / region_width),
+            math.ceil(original_height * FINGERPRINT_SIZE[1] * 4 / region_height),
+        ))
+    if region:
+        # Map the region onto the drafted size
+        factor_x, factor_y = img.width / original_width, img.height / original_height
+        left, top = math.floor(region[0] * factor_x), math.floor(region[1] * factor_y)
+        img = img.crop((
+            left, top,
+            max(left + 1, math.ceil(region[2] * factor_x)), max(top + 1, math.ceil(region[3] * factor_y))
+        ))
+    return img.convert("L").resize(FINGERPRINT_SIZE, Image.BOX)
+
+
+def _source_region(source_size, rotate_angle, crop, crop_aspect_ratio):
+    try:
+        return plan_geometry(source_size, rotate_angle, crop, crop_aspect_ratio).source_region()
+    except GeometryError:
+        # Reported by the snapshot itself
+        return None
+
+
+def change_score(previous: Image.Image, current: Image.Image) -> float:
+    """Mean difference of the most changed block, in percent."""
+    diff = ImageChops.difference(previous, current).resize(BLOCKS, Image.BOX)
+    return round(diff.getextrema()[1] / 255 * 100, 2)
+
+
+class ChangeDetector:
+    """Remembers the fingerprint of the last written snapshot per camera and file path.
+
+    Keyed by file path too, so calls that write the same camera to
+    different files or with different crops each compare against their
+    own last snapshot.
+    """
+
+    def __init__(self):
+        self._fingerprints = LRUCache(MAX_FINGERPRINTS)
+
+    def score(self, camera_entity_id: str, file_path: str, current: Image.Image):
+        """Change against the last snapshot written to file_path, None if there is none."""
+        previous = self._fingerprints.get((camera_entity_id, file_path))
+        if previous is None:
+            return None
+        return change_score(previous, current)
+
+    def update(self, camera_entity_id: str, file_path: str, current: Image.Image):
+        self._fingerprints.put((camera_entity_id, file_path), current)
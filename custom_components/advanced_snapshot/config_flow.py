@@ -7,7 +7,17 @@ from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.config_entries import OptionsFlow  
 
-from .const import DOMAIN
+from homeassistant.helpers.selector import EntitySelector, EntitySelectorConfig
+
+from .const import (
+    DOMAIN, DEFAULT_IMAGE_WORKERS, DEFAULT_IMAGE_QUEUE_SIZE, DEFAULT_PROBE_CACHE_TTL,
+    DEFAULT_PRERECORD_FOLDER, DEFAULT_PRERECORD_SECONDS, DEFAULT_PRERECORD_MAX_MB,
+    DEFAULT_RECORDING_SLOTS, DEFAULT_RECORDING_QUEUE_SIZE,
+    DEFAULT_RETENTION_MAX_AGE_DAYS, DEFAULT_RETENTION_MAX_SIZE_MB, DEFAULT_RETENTION_MAX_FILES,
+    DEFAULT_LATEST_CACHE_MB
+)
+
+CAMERA_SELECTOR = EntitySelector(EntitySelectorConfig(domain="camera", multiple=True))
 
 class AdvancedSnapshotConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Config flow for Advanced Sdddnapshot."""
@@ -34,6 +44,19 @@ class AdvancedSnapshotConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             vol.Required("snapshot_folder", default="/config/www/snapshots/"): str,
             vol.Required("backup_folder", default="/config/www/backupsnapshots/"): str,
             vol.Required("font_folder", default="/config/custom_components/advanced_snapshot/fonts"): str,
+            vol.Required("image_workers", default=DEFAULT_IMAGE_WORKERS): vol.All(vol.Coerce(int), vol.Range(min=1, max=16)),
+            vol.Required("image_queue_size", default=DEFAULT_IMAGE_QUEUE_SIZE): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+            vol.Required("probe_cache_ttl", default=DEFAULT_PROBE_CACHE_TTL): vol.All(vol.Coerce(int), vol.Range(min=60)),
+            vol.Required("latest_cache_mb", default=DEFAULT_LATEST_CACHE_MB): vol.All(vol.Coerce(int), vol.Range(min=0, max=1024)),
+            vol.Required("recording_slots", default=DEFAULT_RECORDING_SLOTS): vol.All(vol.Coerce(int), vol.Range(min=0, max=32)),
+            vol.Required("recording_queue_size", default=DEFAULT_RECORDING_QUEUE_SIZE): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+            vol.Optional("prerecord_cameras", default=[]): CAMERA_SELECTOR,
+            vol.Required("prerecord_seconds", default=DEFAULT_PRERECORD_SECONDS): vol.All(vol.Coerce(int), vol.Range(min=1, max=300)),
+            vol.Required("prerecord_max_mb", default=DEFAULT_PRERECORD_MAX_MB): vol.All(vol.Coerce(int), vol.Range(min=10)),
+            vol.Required("prerecord_folder", default=DEFAULT_PRERECORD_FOLDER): str,
+            vol.Required("retention_max_age_days", default=DEFAULT_RETENTION_MAX_AGE_DAYS): vol.All(vol.Coerce(float), vol.Range(min=0)),
+            vol.Required("retention_max_size_mb", default=DEFAULT_RETENTION_MAX_SIZE_MB): vol.All(vol.Coerce(int), vol.Range(min=0)),
+            vol.Required("retention_max_files", default=DEFAULT_RETENTION_MAX_FILES): vol.All(vol.Coerce(int), vol.Range(min=0)),
         })
 
     @staticmethod
@@ -65,6 +88,19 @@ class AdvancedSnapshotOptionsFlowHandler(OptionsFlow):
             vol.Required("snapshot_folder", default=data.get("snapshot_folder", "/config/www/snapshots/")): str,
             vol.Required("backup_folder", default=data.get("backup_folder", "/config/www/backupsnapshots/")): str,
             vol.Required("font_folder", default=data.get("font_folder", "/config/custom_components/advanced_snapshot/fonts")): str,
+            vol.Required("image_workers", default=data.get("image_workers", DEFAULT_IMAGE_WORKERS)): vol.All(vol.Coerce(int), vol.Range(min=1, max=16)),
+            vol.Required("image_queue_size", default=data.get("image_queue_size", DEFAULT_IMAGE_QUEUE_SIZE)): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+            vol.Required("probe_cache_ttl", default=data.get("probe_cache_ttl", DEFAULT_PROBE_CACHE_TTL)): vol.All(vol.Coerce(int), vol.Range(min=60)),
+            vol.Required("latest_cache_mb", default=data.get("latest_cache_mb", DEFAULT_LATEST_CACHE_MB)): vol.All(vol.Coerce(int), vol.Range(min=0, max=1024)),
+            vol.Required("recording_slots", default=data.get("recording_slots", DEFAULT_RECORDING_SLOTS)): vol.All(vol.Coerce(int), vol.Range(min=0, max=32)),
+            vol.Required("recording_queue_size", default=data.get("recording_queue_size", DEFAULT_RECORDING_QUEUE_SIZE)): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+            vol.Optional("prerecord_cameras", default=data.get("prerecord_cameras", [])): CAMERA_SELECTOR,
+            vol.Required("prerecord_seconds", default=data.get("prerecord_seconds", DEFAULT_PRERECORD_SECONDS)): vol.All(vol.Coerce(int), vol.Range(min=1, max=300)),
+            vol.Required("prerecord_max_mb", default=data.get("prerecord_max_mb", DEFAULT_PRERECORD_MAX_MB)): vol.All(vol.Coerce(int), vol.Range(min=10)),
+            vol.Required("prerecord_folder", default=data.get("prerecord_folder", DEFAULT_PRERECORD_FOLDER)): str,
+            vol.Required("retention_max_age_days", default=data.get("retention_max_age_days", DEFAULT_RETENTION_MAX_AGE_DAYS)): vol.All(vol.Coerce(float), vol.Range(min=0)),
+            vol.Required("retention_max_size_mb", default=data.get("retention_max_size_mb", DEFAULT_RETENTION_MAX_SIZE_MB)): vol.All(vol.Coerce(int), vol.Range(min=0)),
+            vol.Required("retention_max_files", default=data.get("retention_max_files", DEFAULT_RETENTION_MAX_FILES)): vol.All(vol.Coerce(int), vol.Range(min=0)),
         })
         
         return self.async_show_form(step_id="init", data_schema=schema)
\ No newline at end of file
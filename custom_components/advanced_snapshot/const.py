@@ -1 +1,21 @@
 DOMAIN = "advanced_snapshot"
+
+DEFAULT_IMAGE_WORKERS = 2
+DEFAULT_IMAGE_QUEUE_SIZE = 8
+DEFAULT_PROBE_CACHE_TTL = 3600
+
+DEFAULT_PRERECORD_FOLDER = "/tmp/advanced_snapshot_prerecord"
+DEFAULT_PRERECORD_SECONDS = 10
+DEFAULT_PRERECORD_MAX_MB = 200
+
+# 0 derives the number of parallel encodes from the CPU cores
+DEFAULT_RECORDING_SLOTS = 0
+DEFAULT_RECORDING_QUEUE_SIZE = 16
+
+# 0 disables the limit
+DEFAULT_RETENTION_MAX_AGE_DAYS = 0
+DEFAULT_RETENTION_MAX_SIZE_MB = 0
+DEFAULT_RETENTION_MAX_FILES = 0
+
+# Memory for the latest encoded snapshots served over HTTP, 0 disables it
+DEFAULT_LATEST_CACHE_MB = 32
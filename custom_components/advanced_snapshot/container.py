@@ -0,0 +1,96 @@
+import glob
+import os
+
+CONTAINERS = ["mp4", "fragmented_mp4", "hls"]
+DEFAULT_CONTAINER = "mp4"
+
+# Length of an fMP4 fragment or HLS segment
+FRAGMENT_SECONDS = 1
+
+
+def container_args(container: str, file_path: str, encode: bool) -> dict:
+    """ffmpeg output options that write file_path as a plain MP4, a fragmented MP4 or an HLS playlist.
+
+    Fragmented MP4 and HLS are playable while they are written and stay
+    playable if ffmpeg dies. Encoded video gets a keyframe every
+    FRAGMENT_SECONDS; copied video can only be split at the keyframes of
+    the camera, so HLS segments are at least one camera GOP long.
+    """
+    if container == "fragmented_mp4":
+        args = {
+            "format": "mp4",
+            "movflags": "+frag_keyframe+empty_moov+default_base_moof",
+            "frag_duration": FRAGMENT_SECONDS * 1000000,
+        }
+    elif container == "hls":
+        stem = _stem(file_path)
+        args = {
+            "format": "hls",
+            "hls_time": FRAGMENT_SECONDS,
+            "hls_list_size": 0,
+            "hls_playlist_type": "event",
+            "hls_segment_type": "fmp4",
+            "hls_segment_filename": f"{stem}_%05d.m4s",
+            "hls_fmp4_init_filename": f"{os.path.basename(stem)}_init.mp4",
+            "hls_flags": "independent_segments+temp_file",
+        }
+    else:
+        return {"format": "mp4"}
+
+    if encode:
+        args["force_key_frames"] = f"expr:gte(t,n_forced*{FRAGMENT_SECONDS})"
+    return args
+
+
+def container_files(file_path: str, container: str) -> list:
+    """All files of a recording, the playlist of an HLS recording last."""
+    if container != "hls":
+        return [file_path]
+    stem = _stem(file_path)
+    init = glob.glob(f"{glob.escape(stem)}_init.mp4")
+    return [*init, *sorted(glob.glob(f"{glob.escape(stem)}_[0-9]*.m4s")), file_path]
+
+
+def remove_container_files(file_path: str, container: str):
+    """Remove the files of an earlier recording to the same path.
+
+    ffmpeg writes in place, so this also keeps a queued backup that is
+    still hardlinked to the old file intact.
+    """
+    for path in container_files(file_path, container):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def is_available(container: str, progress: dict) -> bool:
+    """Whether the recording may already be played, judged from ffmpeg's progress only.
+
+    Runs on the event loop, so it does not touch the filesystem. Copied
+    HLS video is only cut at the next camera keyframe, so for HLS this
+    only says that the first segment can be complete; playlist_exists
+    then tells if it is.
+    """
+    if container in ("hls", "fragmented_mp4"):
+        return (progress.get("out_time") or 0) > FRAGMENT_SECONDS
+    return False
+
+
+def playlist_exists(file_path: str) -> bool:
+    """Whether ffmpeg has written the HLS playlist, i.e. completed the first segment. Blocking."""
+    # The playlist is written to a temp file and renamed, so it is never partial
+    return os.path.exists(file_path)
+
+
+def local_url(www_folder: str, file_path: str):
+    """URL of a file in Home Assistant's www folder, None for other files."""
+    www_folder = os.path.abspath(www_folder)
+    file_path = os.path.abspath(file_path)
+    if not file_path.startswith(www_folder + os.sep):
+        return None
+    return "/local/" + os.path.relpath(file_path, www_folder).replace(os.sep, "/")
+
+
+def _stem(file_path: str) -> str:
+    return os.path.splitext(file_path)[0]
@@ -0,0 +1,115 @@
+import logging
+import os
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+from .scheduler import ENCODER_PRESETS
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY = "advanced_snapshot.encoder_speed"
+STORAGE_VERSION = 1
+SAVE_DELAY = 10
+
+PROFILES = {
+    "quality": {"preset": "medium", "crf": 18, "tune": "film"},
+    "balanced": {"preset": "veryfast", "crf": 21, "tune": "film"},
+    "realtime": {"preset": "ultrafast", "crf": 23, "tune": "zerolatency"},
+}
+ENCODER_PROFILES = [*PROFILES, "auto"]
+DEFAULT_ENCODER_PROFILE = "quality"
+
+# auto keeps this much headroom above real time
+TARGET_SPEED = 1.15
+# Typical encode time of the libx264 presets relative to medium, to estimate untried presets
+PRESET_COST = {"medium": 1.0, "fast": 0.8, "faster": 0.6, "veryfast": 0.35, "superfast": 0.25, "ultrafast": 0.15}
+# Weight of a new measurement in the moving average
+SMOOTHING = 0.3
+# Shorter encodes are dominated by startup and say little about the speed
+MIN_SAMPLE_SECONDS = 5
+
+
+def encoder_profile(name: str, preset: str = None) -> dict:
+    """Encoder settings of a profile; auto uses the quality settings with the given preset."""
+    profile = dict(PROFILES.get(name, PROFILES["quality"]))
+    if preset:
+        profile["preset"] = preset
+    return profile
+
+
+def realtime_factor(progress: dict, cpu_usage: dict, live: bool, slots: int) -> float:
+    """Seconds of video the encode could produce per second with its share of the CPU.
+
+    ffmpeg's speed is the real-time factor when it reads as fast as it can.
+    A live camera only delivers in real time, so a speed around 1 just
+    means the encode kept up; the headroom is then estimated from the CPU
+    time it needed against the cores one encode slot has.
+    """
+    speed = progress.get("speed")
+    out_time = progress.get("out_time")
+    if not speed or not out_time or out_time < MIN_SAMPLE_SECONDS:
+        return None
+    if not live or speed < 0.95 or not cpu_usage or not cpu_usage.get("cpu_time"):
+        return speed
+    cores = max(1.0, (os.cpu_count() or 1) / max(1, slots))
+    return out_time / (cpu_usage["cpu_time"] / cores)
+
+
+class EncoderTuner:
+    """Learns the encode speed of each preset per camera and resolution.
+
+    The speeds are moving averages of the measured real-time factor and
+    are kept in a Store. For auto, the slowest (best) preset whose speed
+    stays above TARGET_SPEED is chosen; presets that were not tried yet
+    are estimated from the nearest measured one with PRESET_COST.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self.hass = hass
+        self._speeds = {}
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+
+    async def async_load(self):
+        data = await self._store.async_load() or {}
+        self._speeds = data.get("speeds", {})
+
+    async def async_save(self):
+        await self._store.async_save(self._data())
+
+    def stats(self) -> dict:
+        return {key: dict(speeds) for key, speeds in self._speeds.items()}
+
+    def choose(self, camera_entity_id: str, resolution) -> str:
+        speeds = self._speeds.get(_key(camera_entity_id, resolution))
+        if not speeds:
+            return PROFILES["balanced"]["preset"]
+        for preset in ENCODER_PRESETS:
+            if self.estimate(speeds, preset) >= TARGET_SPEED:
+                return preset
+        return ENCODER_PRESETS[-1]
+
+    @staticmethod
+    def estimate(speeds: dict, preset: str) -> float:
+        if preset in speeds:
+            return speeds[preset]
+        index = ENCODER_PRESETS.index(preset)
+        nearest = min(speeds, key=lambda known: abs(ENCODER_PRESETS.index(known) - index))
+        return speeds[nearest] * PRESET_COST[nearest] / PRESET_COST[preset]
+
+    @callback
+    def record(self, camera_entity_id: str, resolution, preset: str, speed: float):
+        if preset not in ENCODER_PRESETS or not speed:
+            return
+        speeds = self._speeds.setdefault(_key(camera_entity_id, resolution), {})
+        old = speeds.get(preset)
+        speeds[preset] = round(speed if old is None else old + SMOOTHING * (speed - old), 3)
+        _LOGGER.debug(f"Encode speed of {camera_entity_id} at {resolution} with {preset}: {speeds[preset]}x")
+        self._store.async_delay_save(self._data, SAVE_DELAY)
+
+    def _data(self) -> dict:
+        return {"speeds": self._speeds}
+
+
+def _key(camera_entity_id: str, resolution) -> str:
+    if resolution:
+        return f"{camera_entity_id}|{resolution[0]}x{resolution[1]}"
+    return camera_entity_id
@@ -0,0 +1,149 @@
+import asyncio
+import collections
+import logging
+import time
+from functools import partial
+from homeassistant.core import HomeAssistant
+from .ingest import async_feed_process
+
+_LOGGER = logging.getLogger(__name__)
+
+STDERR_LINES = 50
+PROGRESS_INTERVAL = 1
+STOP_GRACE_PERIOD = 5
+
+
+class FFmpegTimeoutError(Exception):
+    """Raised when ffmpeg did not finish within its wall-clock timeout."""
+
+
+class FFmpegProcess:
+    """Runs one ffmpeg command as an asyncio subprocess.
+
+    Progress (``-progress pipe:1``) and stderr are read line by line while
+    ffmpeg runs; only the last ``STDERR_LINES`` lines of stderr are kept.
+    Input is fed to stdin from an ingest consumer or by a ``feeder``
+    coroutine function, called with the process, that must close stdin
+    when it ends or is cancelled.
+    The process is stopped gracefully on timeout and cancellation, so MP4
+    files are still finalized: a pipe-fed ffmpeg gets end of input, any
+    other ffmpeg gets ``q`` on stdin. Terminate and kill follow if it
+    does not exit within ``STOP_GRACE_PERIOD`` seconds.
+    """
+
+    def __init__(self, hass: HomeAssistant, args: list, consumer=None,
+                 on_progress=None, timeout: float = None, feeder=None):
+        # Progress goes to stdout, the periodic stats line on stderr is not needed
+        self.args = [args[0], "-nostats", "-progress", "pipe:1", *args[1:]]
+        self.hass = hass
+        self.feeder = feeder
+        if consumer:
+            self.feeder = partial(async_feed_process, consumer)
+        self.on_progress = on_progress
+        self.timeout = timeout
+        self.progress = {}
+        self.returncode = None
+        self._stderr = collections.deque(maxlen=STDERR_LINES)
+        self._process = None
+        self._feed_task = None
+        self._last_progress = 0
+
+    @property
+    def stderr(self) -> str:
+        return "\n".join(self._stderr)
+
+    async def async_run(self) -> int:
+        """Run ffmpeg to completion and return its exit code."""
+        self._process = await asyncio.create_subprocess_exec(
+            *self.args, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        readers = [
+            asyncio.create_task(self._async_read_progress()),
+            asyncio.create_task(self._async_read_stderr()),
+        ]
+        if self.feeder:
+            self._feed_task = self.hass.async_create_background_task(
+                self.feeder(self._process), "advanced_snapshot.ffmpeg_feed"
+            )
+
+        try:
+            await asyncio.wait_for(self._process.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            _LOGGER.warning(f"ffmpeg did not finish within {self.timeout}s, stopping it")
+            await self.async_stop()
+            raise FFmpegTimeoutError(f"ffmpeg did not finish within {self.timeout}s") from None
+        except asyncio.CancelledError:
+            await asyncio.shield(self.async_stop())
+            raise
+        finally:
+            if self._feed_task:
+                self._feed_task.cancel()
+            # The pipes are at EOF once the process has exited
+            await asyncio.wait(readers, timeout=STOP_GRACE_PERIOD)
+            for reader in readers:
+                reader.cancel()
+
+        self.returncode = self._process.returncode
+        return self.returncode
+
+    async def async_stop(self):
+        """Ask ffmpeg to finish the output, then terminate or kill it."""
+        process = self._process
+        if process is None or process.returncode is not None:
+            return
+        if self._feed_task:
+            # Closes stdin, ffmpeg sees the end of its input
+            self._feed_task.cancel()
+        else:
+            try:
+                process.stdin.write(b"q")
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        for stop in (None, process.terminate, process.kill):
+            if stop:
+                stop()
+            try:
+                await asyncio.wait_for(process.wait(), STOP_GRACE_PERIOD)
+                return
+            except asyncio.TimeoutError:
+                continue
+
+    async def _async_read_stderr(self):
+        while line := await self._process.stderr.readline():
+            self._stderr.append(line.decode("utf-8", errors="ignore").rstrip())
+
+    async def _async_read_progress(self):
+        block = {}
+        while line := await self._process.stdout.readline():
+            key, _, value = line.decode("utf-8", errors="ignore").strip().partition("=")
+            if key != "progress":
+                block[key] = value
+                continue
+            self.progress.update((k, v) for k, v in parse_progress(block).items() if v is not None)
+            block = {}
+            now = time.monotonic()
+            if self.on_progress and (value == "end" or now - self._last_progress >= PROGRESS_INTERVAL):
+                self._last_progress = now
+                self.on_progress({**self.progress, "done": value == "end"})
+
+
+def parse_progress(block: dict) -> dict:
+    """Convert one block of ffmpeg -progress output into numbers."""
+    def number(value, kind=float):
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            return None
+
+    out_time_us = number(block.get("out_time_us") or block.get("out_time_ms"), int)
+    speed = block.get("speed", "").rstrip("x")
+    return {
+        "frame": number(block.get("frame"), int),
+        "fps": number(block.get("fps")),
+        "speed": number(speed),
+        "bytes_written": number(block.get("total_size"), int),
+        "out_time": round(out_time_us / 1000000, 3) if out_time_us is not None else None,
+    }
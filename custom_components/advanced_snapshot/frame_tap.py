@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from PIL import Image
+from homeassistant.core import HomeAssistant, callback
+from .ingest import async_feed_process
+
+_LOGGER = logging.getLogger(__name__)
+
+FRAME_TAP_IDLE_TIMEOUT = 60
+
+
+class FrameTap:
+    """Decodes the keyframes of a camera's shared ingest into raw RGB frames.
+
+    ffmpeg skips all non-key frames before decoding and writes each
+    keyframe as rgb24 to a pipe. The newest frame is kept as an immutable
+    bytes object, so snapshots wrap it with Image.frombuffer without
+    copying the pixel data.
+    """
+
+    def __init__(self, manager, camera_entity_id: str):
+        self.manager = manager
+        self.camera_entity_id = camera_entity_id
+        self.frame = None
+        self.frame_time = None
+        self.size = None
+        self.closed = False
+        self._waiters = []
+        self._process = None
+        self._task = None
+        self._idle_handle = None
+
+    def start(self):
+        self._task = self.manager.hass.async_create_background_task(
+            self._async_run(), f"advanced_snapshot.frame_tap.{self.camera_entity_id}"
+        )
+
+    async def _async_run(self):
+        try:
+            consumer = await self.manager.ingest_manager.async_acquire(self.camera_entity_id)
+            if not consumer:
+                _LOGGER.warning(f"Frame tap: no stream for {self.camera_entity_id}")
+                return
+            try:
+                await self._async_decode(consumer)
+            finally:
+                consumer.release()
+        finally:
+            self._close()
+
+    async def _async_decode(self, consumer):
+        feed_task = None
+        try:
+            stream_info = consumer.session.stream_info
+            if not stream_info and self.manager.probe_cache:
+                stream_info = await self.manager.probe_cache.async_probe(consumer.session.stream)
+            if not stream_info:
+                _LOGGER.warning(f"Frame tap: resolution of {self.camera_entity_id} is unknown")
+                return
+
+            width, height = stream_info["width"], stream_info["height"]
+            args = [
+                "ffmpeg", "-hide_banner", "-loglevel", "error",
+                "-skip_frame", "nokey", "-f", "mpegts", "-i", "pipe:0",
+                "-map", "0:v:0", "-vsync", "0",
+                # Keeps the frame size fixed even if the camera changes its resolution
+                "-vf", f"scale={width}:{height}",
+                "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
+            ]
+            self._process = await asyncio.create_subprocess_exec(
+                *args, stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+            )
+            feed_task = self.manager.hass.async_create_background_task(
+                async_feed_process(consumer, self._process), f"advanced_snapshot.frame_tap_feed.{self.camera_entity_id}"
+            )
+            _LOGGER.info(f"Started frame tap for {self.camera_entity_id} ({width}x{height})")
+
+            frame_size = width * height * 3
+            while True:
+                frame = await self._process.stdout.readexactly(frame_size)
+                self._set_frame(frame, (width, height))
+        except asyncio.IncompleteReadError:
+            _LOGGER.debug(f"Frame tap for {self.camera_entity_id} ended")
+        finally:
+            if feed_task:
+                feed_task.cancel()
+            if self._process and self._process.returncode is None:
+                self._process.terminate()
+                try:
+                    await asyncio.wait_for(self._process.wait(), 5)
+                except asyncio.TimeoutError:
+                    self._process.kill()
+
+    @callback
+    def _set_frame(self, frame: bytes, size: tuple):
+        self.frame = frame
+        self.size = size
+        self.frame_time = time.time()
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(self.image())
+
+    def image(self) -> Image.Image:
+        """The newest frame as a read-only image sharing the frame's memory."""
+        return Image.frombuffer("RGB", self.size, self.frame, "raw", "RGB", 0, 1)
+
+    async def async_next_frame(self, timeout: float):
+        """Wait for the next keyframe, or None if the tap stops first."""
+        waiter = self.manager.hass.loop.create_future()
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def touch(self):
+        if self._idle_handle:
+            self._idle_handle.cancel()
+        self._idle_handle = self.manager.hass.loop.call_later(self.manager.idle_timeout, self.stop)
+
+    async def async_wait_closed(self, timeout: float = 10):
+        if self._task:
+            await asyncio.wait([self._task], timeout=timeout)
+
+    @callback
+    def stop(self):
+        self._idle_handle = None
+        if self._task and not self._task.done():
+            _LOGGER.info(f"Stopping idle frame tap for {self.camera_entity_id}")
+            self._task.cancel()
+
+    @callback
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._idle_handle:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.manager.tap_closed(self)
+
+
+class FrameTapManager:
+    """Starts a frame tap per camera on demand and stops it when unused.
+
+    A tap keeps running for ``idle_timeout`` seconds after the last
+    snapshot, so following snapshots only wait for the next keyframe.
+    """
+
+    def __init__(self, hass: HomeAssistant, ingest_manager, probe_cache=None,
+                 idle_timeout: float = FRAME_TAP_IDLE_TIMEOUT):
+        self.hass = hass
+        self.ingest_manager = ingest_manager
+        self.probe_cache = probe_cache
+        self.idle_timeout = idle_timeout
+        self._taps = {}
+
+    async def async_next_frame(self, camera_entity_id: str, timeout: float):
+        """Return the next keyframe of the camera as an image, or None."""
+        tap = self._taps.get(camera_entity_id)
+        if tap is None or tap.closed:
+            tap = FrameTap(self, camera_entity_id)
+            self._taps[camera_entity_id] = tap
+            tap.start()
+        tap.touch()
+        return await tap.async_next_frame(timeout)
+
+    @callback
+    def tap_closed(self, tap: FrameTap):
+        if self._taps.get(tap.camera_entity_id) is tap:
+            del self._taps[tap.camera_entity_id]
+
+    async def async_stop(self):
+        for tap in list(self._taps.values()):
+            tap.stop()
+            await tap.async_wait_closed()
@@ -0,0 +1,289 @@
+import contextlib
+import math
+from PIL import Image
+
+# PIL rotates counter-clockwise
+_TRANSPOSE = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+
+class GeometryError(ValueError):
+    """Invalid crop options; the message is returned to the caller."""
+
+
+def resolve_crop(crop, crop_aspect_ratio):
+    """Return the (x, y, width, height) of the crop option, or None without crop.
+
+    The height is taken from crop_aspect_ratio if given, otherwise from
+    the fourth crop value.
+    """
+    if not crop:
+        return None
+    if len(crop) < 3:
+        raise GeometryError("Invalid crop values")
+
+    x, y, w = crop[:3]
+    h = crop[3] if len(crop) == 4 else None
+    if crop_aspect_ratio:
+        try:
+            aspect_w, aspect_h = map(int, crop_aspect_ratio.split(":"))
+            h = int(w * (aspect_h / aspect_w))
+        except (ValueError, ZeroDivisionError):
+            raise GeometryError("Invalid aspect ratio format")
+
+    if h is None:
+        raise GeometryError("Height (h) is missing and no aspect ratio provided.")
+    if x < 0 or y < 0 or w <= 0 or h <= 0:
+        raise GeometryError("Invalid crop dimensions")
+    return x, y, w, h
+
+
+def rotated_size(width: int, height: int, angle: float) -> tuple:
+    """Size of an image after img.rotate(angle, expand=True), computed like PIL does."""
+    angle = angle % 360
+    if angle in (0, 180):
+        return width, height
+    if angle in (90, 270):
+        return height, width
+
+    return _rotation(width, height, angle)[1]
+
+
+def plan_geometry(source_size, rotate_angle, crop, crop_aspect_ratio):
+    """Validate the rotate and crop options of a frame and plan their transform.
+
+    source_size may be None if the frame size is unknown, e.g. for a
+    stream that could not be probed; the crop is then not checked.
+    """
+    rect = resolve_crop(crop, crop_aspect_ratio)
+    crop_box = None
+    if rect:
+        x, y, w, h = rect
+        crop_box = (x, y, x + w, y + h)
+        if source_size:
+            rotated_width, rotated_height = rotated_size(*source_size, rotate_angle or 0)
+            if crop_box[2] > rotated_width or crop_box[3] > rotated_height:
+                raise GeometryError("Invalid crop area")
+    return GeometryPlan(source_size, rotate_angle or 0, crop_box)
+
+
+class GeometryPlan:
+    """Rotation and crop of a frame, reduced to the fewest pixel operations.
+
+    The result always equals img.rotate(rotate_angle, expand=True) followed
+    by a crop to crop_box, which is given in rotated coordinates. For
+    right angles the crop is moved in front of the rotation, mapped back
+    to source coordinates, and the rotation becomes a lossless transpose
+    of only the kept pixels. Other angles are one affine transform that
+    renders only the cropped region. The same plan is applied to PIL
+    images or to an ffmpeg-python stream.
+    """
+
+    def __init__(self, source_size, rotate_angle: float, crop_box=None):
+        self.source_size = tuple(source_size) if source_size else None
+        self.rotate_angle = rotate_angle % 360
+        self.crop_box = tuple(crop_box) if crop_box else None
+        self.source_box = None
+        self.matrix = None
+
+        if self.source_size is None:
+            self.output_size = _box_size(self.crop_box) if self.crop_box else None
+            return
+
+        self.rotated_size = rotated_size(*self.source_size, self.rotate_angle)
+        box = self.crop_box or (0, 0, *self.rotated_size)
+        self.output_size = _box_size(box)
+        if self.rotate_angle % 90 == 0:
+            if self.crop_box:
+                self.source_box = _unrotate_box(self.crop_box, self.source_size, self.rotate_angle)
+        else:
+            matrix = _rotation_matrix(*self.source_size, self.rotate_angle)
+            a, b, c, d, e, f = matrix
+            # Start the transform at the crop origin, so only the kept region is rendered
+            self.matrix = (a, b, a * box[0] + b * box[1] + c, d, e, d * box[0] + e * box[1] + f)
+
+    @property
+    def is_identity(self) -> bool:
+        return not self.rotate_angle and not self.crop_box
+
+    @property
+    def transpose(self):
+        return _TRANSPOSE.get(self.rotate_angle)
+
+    def scaled(self, size) -> "GeometryPlan":
+        """The same plan for the frame decoded at a reduced size, e.g. a drafted JPEG."""
+        size = tuple(size)
+        if size == self.source_size:
+            return self
+        crop_box = None
+        if self.crop_box:
+            factor = size[0] / self.source_size[0]
+            rotated_width, rotated_height = rotated_size(*size, self.rotate_angle)
+            x1, y1, x2, y2 = self.crop_box
+            crop_box = (
+                int(x1 * factor), int(y1 * factor),
+                min(rotated_width, round(x2 * factor)), min(rotated_height, round(y2 * factor))
+            )
+        return GeometryPlan(size, self.rotate_angle, crop_box)
+
+    def source_region(self):
+        """Box of the source frame that ends up in the crop, None if the whole frame is kept."""
+        if not self.crop_box or self.source_size is None:
+            return None
+        if self.source_box:
+            return self.source_box
+        x1, y1, x2, y2 = self.crop_box
+        matrix = _rotation_matrix(*self.source_size, self.rotate_angle)
+        corners = [_to_source(matrix, x, y) for x, y in ((x1, y1), (x2, y1), (x2, y2), (x1, y2))]
+        width, height = self.source_size
+        left = max(0, math.floor(min(x for x, _ in corners)))
+        top = max(0, math.floor(min(y for _, y in corners)))
+        right = min(width, math.ceil(max(x for x, _ in corners)))
+        bottom = min(height, math.ceil(max(y for _, y in corners)))
+        if left >= right or top >= bottom:
+            # The crop only shows the fill around the rotated frame
+            return None
+        return left, top, right, bottom
+
+    def apply(self, img: Image.Image, timer=None) -> Image.Image:
+        """Transform a PIL image of source_size."""
+        def stage(name):
+            return timer.stage(name) if timer else contextlib.nullcontext()
+
+        if self.matrix:
+            # Same mapping and default resampling as img.rotate
+            with stage("rotate"):
+                return img.transform(self.output_size, Image.Transform.AFFINE, self.matrix, Image.NEAREST)
+        if self.source_box:
+            with stage("crop"):
+                img = img.crop(self.source_box)
+        if self.transpose is not None:
+            with stage("rotate"):
+                img = img.transpose(self.transpose)
+        return img
+
+    def apply_ffmpeg(self, stream):
+        """Add the filters of the plan to an ffmpeg-python video stream."""
+        angle = self.rotate_angle
+        if angle % 90 == 0 and self.source_size:
+            if self.source_box:
+                stream = _ffmpeg_crop(stream, self.source_box)
+            return _ffmpeg_transpose(stream, angle)
+
+        if angle % 90 == 0:
+            stream = _ffmpeg_transpose(stream, angle)
+        elif self.source_size is None:
+            # ffmpeg's own bounding box, close to the one of PIL
+            radians = math.radians(angle)
+            stream = stream.filter(
+                "rotate", -radians, ow=f"rotw({radians})", oh=f"roth({radians})", fillcolor="black"
+            )
+        elif self.crop_box:
+            source_box = self._rotation_source_box()
+            if source_box:
+                # Rotate only the source region around the crop, centered on the crop
+                stream = _ffmpeg_crop(stream, source_box)
+                return stream.filter(
+                    "rotate", -math.radians(angle), ow=self.output_size[0], oh=self.output_size[1],
+                    fillcolor="black"
+                )
+            stream = _ffmpeg_rotate(stream, angle, self.rotated_size)
+        else:
+            # H.264 in yuv420p needs an even frame size
+            width, height = self.rotated_size
+            self.output_size = (width + width % 2, height + height % 2)
+            return _ffmpeg_rotate(stream, angle, self.output_size)
+
+        if self.crop_box:
+            stream = _ffmpeg_crop(stream, self.crop_box)
+        return stream
+
+    def _rotation_source_box(self):
+        """Source region whose rotation covers the crop, or None if it leaves the frame."""
+        x1, y1, x2, y2 = self.crop_box
+        center_x, center_y = _to_source(
+            _rotation_matrix(*self.source_size, self.rotate_angle), (x1 + x2) / 2, (y1 + y2) / 2
+        )
+        radians = math.radians(self.rotate_angle)
+        cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+        width, height = x2 - x1, y2 - y1
+        needed_width = width * cos + height * sin + 2
+        needed_height = width * sin + height * cos + 2
+
+        # Even offsets survive chroma subsampling; the size puts the center on the crop center
+        left = 2 * math.floor((center_x - needed_width / 2) / 2)
+        top = 2 * math.floor((center_y - needed_height / 2) / 2)
+        box = (left, top, left + round(2 * (center_x - left)), top + round(2 * (center_y - top)))
+        if box[0] < 0 or box[1] < 0 or box[2] > self.source_size[0] or box[3] > self.source_size[1]:
+            return None
+        return box
+
+
+def _box_size(box) -> tuple:
+    return box[2] - box[0], box[3] - box[1]
+
+
+def _rotation_matrix(width: int, height: int, angle: float) -> tuple:
+    """Affine matrix of img.rotate(angle, expand=True), mapping output to source pixels."""
+    return _rotation(width, height, angle)[0]
+
+
+def _rotation(width: int, height: int, angle: float) -> tuple:
+    """Matrix and size of img.rotate(angle, expand=True), computed like PIL does."""
+    radians = -math.radians(angle)
+    a, b = round(math.cos(radians), 15), round(math.sin(radians), 15)
+    d, e = round(-math.sin(radians), 15), round(math.cos(radians), 15)
+    center_x, center_y = width / 2, height / 2
+    c = a * -center_x + b * -center_y + center_x
+    f = d * -center_x + e * -center_y + center_y
+
+    xx = []
+    yy = []
+    for x, y in ((0, 0), (width, 0), (width, height), (0, height)):
+        xx.append(a * x + b * y + c)
+        yy.append(d * x + e * y + f)
+    new_width = math.ceil(max(xx)) - math.floor(min(xx))
+    new_height = math.ceil(max(yy)) - math.floor(min(yy))
+    offset_x, offset_y = -(new_width - width) / 2.0, -(new_height - height) / 2.0
+    matrix = (a, b, a * offset_x + b * offset_y + c, d, e, d * offset_x + e * offset_y + f)
+    return matrix, (new_width, new_height)
+
+
+def _to_source(matrix: tuple, x: float, y: float) -> tuple:
+    a, b, c, d, e, f = matrix
+    return a * x + b * y + c, d * x + e * y + f
+
+
+def _unrotate_box(box: tuple, source_size: tuple, angle: int) -> tuple:
+    """Map a box in the coordinates of the rotated frame back to the source frame."""
+    width, height = source_size
+    x1, y1, x2, y2 = box
+    if angle == 90:
+        return width - y2, x1, width - y1, x2
+    if angle == 180:
+        return width - x2, height - y2, width - x1, height - y1
+    if angle == 270:
+        return y1, height - x2, y2, height - x1
+    return box
+
+
+def _ffmpeg_crop(stream, box: tuple):
+    x1, y1, x2, y2 = box
+    return stream.crop(x=x1, y=y1, width=x2 - x1, height=y2 - y1)
+
+
+def _ffmpeg_transpose(stream, angle: int):
+    if angle == 90:
+        return stream.filter("transpose", "cclock")
+    if angle == 180:
+        return stream.hflip().vflip()
+    if angle == 270:
+        return stream.filter("transpose", "clock")
+    return stream
+
+
+def _ffmpeg_rotate(stream, angle: float, size: tuple):
+    return stream.filter("rotate", -math.radians(angle), ow=size[0], oh=size[1], fillcolor="black")
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ImagePoolFullError(Exception):
+    """Raised when the image processing queue is full."""
+
+
+class ImageProcessingPool:
+    """Dedicated worker pool for decode, transform and encode jobs.
+
+    Jobs beyond ``max_workers`` wait in a queue of at most ``max_queue``
+    entries. Further submissions are rejected instead of piling up.
+    The counters are only touched from the event loop.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="advanced_snapshot_image",
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.pending - self.max_workers)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "active": min(self.pending, self.max_workers),
+            "depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+    async def async_submit(self, func, *args):
+        """Run func(*args) on the pool and wait for its result."""
+        if self.pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            _LOGGER.warning(f"Image processing queue is full ({self.max_queue} waiting), rejecting job")
+            raise ImagePoolFullError("Image processing queue is full")
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.components.camera import async_get_stream_source
+
+_LOGGER = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+CONSUMER_QUEUE_CHUNKS = 256
+IDLE_TIMEOUT = 10
+
+# Audio codecs that can be copied into MPEG-TS, others are converted to AAC
+TS_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "opus"}
+
+
+def ingest_audio_codec(audio_codec):
+    """Audio codec of the MPEG-TS delivered by an ingest session."""
+    if audio_codec and audio_codec not in TS_AUDIO_CODECS:
+        return "aac"
+    return audio_codec
+
+
+class IngestConsumer:
+    """One reader of an ingest session, receiving the stream as MPEG-TS chunks.
+
+    Each consumer has its own bounded queue. A consumer that cannot keep
+    up loses chunks instead of slowing down the other consumers.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.dropped = 0
+        self._queue = asyncio.Queue(CONSUMER_QUEUE_CHUNKS)
+
+    def put(self, chunk):
+        try:
+            self._queue.put_nowait(chunk)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def flush(self):
+        """Drop the chunks received so far."""
+        while not self._queue.empty():
+            if self._queue.get_nowait() is None:
+                self._queue.put_nowait(None)
+                return
+
+    def close(self):
+        while self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self._queue.get()
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    def release(self):
+        self.session.manager.release(self)
+
+
+class IngestSession:
+    """Single upstream connection to a camera, copied to MPEG-TS on a pipe."""
+
+    def __init__(self, manager, camera_entity_id: str, stream: str, stream_info: dict):
+        self.manager = manager
+        self.camera_entity_id = camera_entity_id
+        self.stream = stream
+        self.stream_info = stream_info
+        self.consumers = set()
+        self.closed = False
+        self.stopping = False
+        self._process = None
+        self._reader = None
+        self._idle_handle = None
+
+    async def async_start(self):
+        audio_codec = self.stream_info.get("audio_codec") if self.stream_info else None
+        args = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin"]
+        if self.stream.startswith("rtsp"):
+            args += ["-rtsp_transport", "tcp", "-timeout", "5000000", "-max_delay", "500000"]
+        args += [
+            "-i", self.stream,
+            "-map", "0:v", "-map", "0:a?",
+            "-c:v", "copy",
+            "-c:a", "copy" if audio_codec in TS_AUDIO_CODECS else "aac",
+            "-f", "mpegts", "pipe:1",
+        ]
+        self._process = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        self._reader = self.manager.hass.async_create_background_task(
+            self._async_read(), f"advanced_snapshot.ingest.{self.camera_entity_id}"
+        )
+        _LOGGER.info(f"Started shared ingest for {self.camera_entity_id}")
+
+    async def _async_read(self):
+        stderr_task = asyncio.create_task(self._process.stderr.read())
+        try:
+            while chunk := await self._process.stdout.read(CHUNK_SIZE):
+                for consumer in self.consumers:
+                    consumer.put(chunk)
+        finally:
+            await self._async_terminate()
+            stderr = await stderr_task
+            if stderr:
+                _LOGGER.warning(f"Ingest for {self.camera_entity_id} ended: {stderr.decode('utf-8', errors='ignore')[-500:]}")
+            self._close()
+
+    async def _async_terminate(self):
+        if self._process.returncode is None:
+            self._process.terminate()
+            try:
+                await asyncio.wait_for(self._process.wait(), 5)
+            except asyncio.TimeoutError:
+                self._process.kill()
+                await self._process.wait()
+
+    @callback
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.cancel_idle()
+        for consumer in self.consumers:
+            consumer.close()
+        self.consumers.clear()
+        self.manager.session_closed(self)
+
+    def add_consumer(self) -> IngestConsumer:
+        self.cancel_idle()
+        consumer = IngestConsumer(self)
+        self.consumers.add(consumer)
+        return consumer
+
+    def cancel_idle(self):
+        if self._idle_handle:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+    def schedule_idle_stop(self, timeout: float):
+        self.cancel_idle()
+        self._idle_handle = self.manager.hass.loop.call_later(timeout, self.stop)
+
+    async def async_wait_closed(self, timeout: float = 10):
+        if self._reader:
+            await asyncio.wait([self._reader], timeout=timeout)
+
+    @callback
+    def stop(self):
+        self._idle_handle = None
+        self.stopping = True
+        if self._process and self._process.returncode is None:
+            _LOGGER.info(f"Stopping idle shared ingest for {self.camera_entity_id}")
+            self._process.terminate()
+
+
+class IngestManager:
+    """Keeps at most one upstream connection per camera and fans it out.
+
+    Consumers are reference counted; a session without consumers is shut
+    down after ``idle_timeout`` seconds.
+    """
+
+    def __init__(self, hass: HomeAssistant, probe_cache=None, idle_timeout: float = IDLE_TIMEOUT):
+        self.hass = hass
+        self.probe_cache = probe_cache
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._locks = {}
+
+    async def async_acquire(self, camera_entity_id: str):
+        """Return a new consumer for the camera, or None if it has no stream."""
+        lock = self._locks.setdefault(camera_entity_id, asyncio.Lock())
+        async with lock:
+            session = self._sessions.get(camera_entity_id)
+            # A stopping session may still be in the dict until its reader has ended
+            if session is None or session.closed or session.stopping:
+                stream = await async_get_stream_source(self.hass, camera_entity_id)
+                if not stream:
+                    return None
+                stream_info = self.probe_cache.get(stream) if self.probe_cache else None
+                session = IngestSession(self, camera_entity_id, stream, stream_info)
+                await session.async_start()
+                self._sessions[camera_entity_id] = session
+            return session.add_consumer()
+
+    @callback
+    def release(self, consumer: IngestConsumer):
+        session = consumer.session
+        session.consumers.discard(consumer)
+        if not session.consumers and not session.closed:
+            session.schedule_idle_stop(self.idle_timeout)
+
+    @callback
+    def session_closed(self, session: IngestSession):
+        if self._sessions.get(session.camera_entity_id) is session:
+            del self._sessions[session.camera_entity_id]
+
+    def consumer_count(self, camera_entity_id: str) -> int:
+        session = self._sessions.get(camera_entity_id)
+        return len(session.consumers) if session else 0
+
+    async def async_stop(self):
+        for session in list(self._sessions.values()):
+            session.stop()
+            await session.async_wait_closed()
+
+
+async def async_feed_process(consumer: IngestConsumer, process):
+    """Write the chunks of consumer into the stdin of process until either ends."""
+    try:
+        async for chunk in consumer:
+            process.stdin.write(chunk)
+            await process.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        if not process.stdin.is_closing():
+            process.stdin.close()
@@ -0,0 +1,65 @@
+import logging
+import shutil
+import subprocess
+from PIL import Image
+
+_LOGGER = logging.getLogger(__name__)
+
+JPEGTRAN = shutil.which("jpegtran")
+
+# PIL rotates counter-clockwise, jpegtran clockwise
+_JPEGTRAN_ROTATION = {90: "270", 180: "180", 270: "90"}
+
+
+def mcu_size(img: Image.Image, rotate_angle: int = 0) -> tuple:
+    """Return the (width, height) of one MCU of a JPEG after rotation."""
+    layers = getattr(img, "layer", None) or [("", 1, 1, 0)]
+    mcu_w = 8 * max(layer[1] for layer in layers)
+    mcu_h = 8 * max(layer[2] for layer in layers)
+    if rotate_angle % 180 == 90:
+        return mcu_h, mcu_w
+    return mcu_w, mcu_h
+
+
+def can_transform_lossless(img: Image.Image, rotate_angle: int, crop_box) -> bool:
+    """Check whether rotate and crop can be done on the compressed data."""
+    if img.format != "JPEG" or rotate_angle % 90:
+        return False
+    if rotate_angle % 360 and not JPEGTRAN:
+        return False
+    if crop_box:
+        if not JPEGTRAN:
+            return False
+        mcu_w, mcu_h = mcu_size(img, rotate_angle)
+        if crop_box[0] % mcu_w or crop_box[1] % mcu_h:
+            return False
+    return True
+
+
+def transform_lossless(content: bytes, rotate_angle: int, crop_box):
+    """Rotate by a right angle and crop a JPEG without re-encoding.
+
+    Returns the new JPEG data, or None if jpegtran could not do the
+    transformation losslessly.
+    """
+    rotate_angle %= 360
+    if not rotate_angle and not crop_box:
+        return content
+
+    args = [JPEGTRAN, "-copy", "all", "-perfect"]
+    if rotate_angle:
+        args += ["-rotate", _JPEGTRAN_ROTATION[rotate_angle]]
+    if crop_box:
+        x1, y1, x2, y2 = crop_box
+        args += ["-crop", f"{x2 - x1}x{y2 - y1}+{x1}+{y1}"]
+
+    try:
+        result = subprocess.run(args, input=content, capture_output=True, timeout=10, check=False)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        _LOGGER.warning(f"jpegtran failed: {str(e)}")
+        return None
+
+    if result.returncode != 0 or not result.stdout:
+        _LOGGER.debug(f"jpegtran could not transform losslessly: {result.stderr.decode('utf-8', errors='ignore')}")
+        return None
+    return result.stdout
@@ -0,0 +1,88 @@
+import email.utils
+import hashlib
+import logging
+import threading
+import time
+from aiohttp import web
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.core import HomeAssistant
+from .const import DOMAIN
+from .overlay import LRUCache
+
+_LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+MAX_ENTRIES = 256
+
+
+class LatestImage:
+    def __init__(self, data: bytes, image_format: str):
+        self.data = data
+        self.content_type = CONTENT_TYPES.get(image_format, "application/octet-stream")
+        self.etag = f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+        # HTTP dates have a resolution of one second
+        self.last_modified = int(time.time())
+
+
+class LatestImageCache:
+    """Encoded bytes of the latest snapshot per camera and output, bounded by ``max_bytes``.
+
+    Filled from the image workers, read by LatestSnapshotView. The first
+    output of the latest call is also served without an output name.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._cache = LRUCache(MAX_ENTRIES, max_bytes, sizeof=lambda entry: len(entry.data))
+        self._main = {}
+        self._lock = threading.Lock()
+
+    def put(self, camera_entity_id: str, name: str, data: bytes, image_format: str, main: bool = False):
+        self._cache.put((camera_entity_id, name), LatestImage(data, image_format))
+        if main:
+            with self._lock:
+                self._main[camera_entity_id] = name
+
+    def get(self, camera_entity_id: str, name: str = None):
+        if name is None:
+            with self._lock:
+                name = self._main.get(camera_entity_id)
+        return self._cache.get((camera_entity_id, name))
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+def latest_url(camera_entity_id: str, name: str) -> str:
+    return f"/api/{DOMAIN}/latest/{camera_entity_id}/{name}"
+
+
+class LatestSnapshotView(HomeAssistantView):
+    """Serve the cached latest snapshots with ETag and Last-Modified revalidation."""
+
+    url = f"/api/{DOMAIN}/latest/{{camera_entity_id}}"
+    extra_urls = [f"/api/{DOMAIN}/latest/{{camera_entity_id}}/{{name}}"]
+    name = f"api:{DOMAIN}:latest"
+
+    def __init__(self, hass: HomeAssistant):
+        self.hass = hass
+
+    async def get(self, request: web.Request, camera_entity_id: str, name: str = None) -> web.Response:
+        cache = self.hass.data.get(DOMAIN, {}).get("latest_cache")
+        entry = cache.get(camera_entity_id, name) if cache else None
+        if entry is None:
+            return web.Response(status=404)
+
+        headers = {
+            "ETag": entry.etag,
+            "Last-Modified": email.utils.formatdate(entry.last_modified, usegmt=True),
+            # Always revalidate, a new snapshot must show up right away
+            "Cache-Control": "no-cache",
+        }
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            if entry.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+                return web.Response(status=304, headers=headers)
+        elif request.if_modified_since and request.if_modified_since.timestamp() >= entry.last_modified:
+            return web.Response(status=304, headers=headers)
+
+        return web.Response(body=entry.data, content_type=entry.content_type, headers=headers)
@@ -0,0 +1,97 @@
+import cProfile
+import collections
+import logging
+import math
+import os
+import time
+from contextlib import contextmanager
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+
+_LOGGER = logging.getLogger(__name__)
+
+SIGNAL_TIMINGS_NEW = "advanced_snapshot_timings_new"
+SIGNAL_TIMINGS_UPDATED = "advanced_snapshot_timings_updated"
+
+TIMING_WINDOW = 100
+
+
+class StageTimer:
+    """Adds up the wall-clock time spent in named stages of one call."""
+
+    def __init__(self):
+        self.timings = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def result(self) -> dict:
+        timings = {name: round(seconds, 4) for name, seconds in self.timings.items()}
+        timings["total"] = round(time.perf_counter() - self._start, 4)
+        return timings
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+class TimingStats:
+    """Rolling window of the last ``window`` stage timings per camera and operation."""
+
+    def __init__(self, hass: HomeAssistant, window: int = TIMING_WINDOW):
+        self.hass = hass
+        self.window = window
+        self._samples = {}
+
+    @property
+    def keys(self) -> list:
+        return list(self._samples)
+
+    @callback
+    def add(self, camera_entity_id: str, operation: str, timings: dict):
+        key = (camera_entity_id, operation)
+        stages = self._samples.get(key)
+        is_new = stages is None
+        if is_new:
+            stages = self._samples[key] = {}
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, collections.deque(maxlen=self.window)).append(seconds)
+
+        if is_new:
+            async_dispatcher_send(self.hass, SIGNAL_TIMINGS_NEW, key)
+        async_dispatcher_send(self.hass, f"{SIGNAL_TIMINGS_UPDATED}_{camera_entity_id}_{operation}")
+
+    def summary(self, camera_entity_id: str, operation: str) -> dict:
+        """Return {stage: {"p50", "p95", "max", "count"}} in seconds."""
+        summary = {}
+        for stage, samples in self._samples.get((camera_entity_id, operation), {}).items():
+            values = sorted(samples)
+            summary[stage] = {
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "max": values[-1],
+                "count": len(values),
+            }
+        return summary
+
+
+def run_profiled(profile_path: str, func, *args):
+    """Run func(*args) under cProfile and dump the stats to profile_path."""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+        profiler.dump_stats(profile_path)
+        _LOGGER.info(f"Profile written to {profile_path}")
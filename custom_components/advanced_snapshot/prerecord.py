@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+from homeassistant.core import HomeAssistant
+from .ingest import async_feed_process
+from .storage import make_dirs
+
+_LOGGER = logging.getLogger(__name__)
+
+SEGMENT_TIME = 2
+RESTART_DELAY_MIN = 5
+RESTART_DELAY_MAX = 300
+# A buffer whose newest segment started longer ago than this has stalled
+STALL_SECONDS = 5 * SEGMENT_TIME
+
+
+class PrerecordBuffer:
+    """Rolling on-disk buffer of short stream-copied segments for one camera.
+
+    A background ffmpeg reads the camera's shared ingest and writes
+    MPEG-TS segments named after their start time. Segments older than ``seconds`` or beyond ``max_bytes`` are
+    deleted. Recordings hard-link the segments they need into their own
+    directory, so eviction never removes data a clip still uses.
+    """
+
+    def __init__(self, hass: HomeAssistant, camera_entity_id: str, folder: str,
+                 seconds: int, max_bytes: int, ingest_manager):
+        self.hass = hass
+        self.camera_entity_id = camera_entity_id
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.ingest_manager = ingest_manager
+        self.folder = folder
+        self.segment_dir = os.path.join(folder, camera_entity_id.replace(".", "_"))
+        self.clip_dir = os.path.join(folder, "clips")
+        self._process = None
+        self._task = None
+        self._stopped = False
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    def start(self):
+        self._stopped = False
+        self._task = self.hass.async_create_background_task(
+            self._async_run(), f"advanced_snapshot.prerecord.{self.camera_entity_id}"
+        )
+
+    async def async_stop(self):
+        self._stopped = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.hass.async_add_executor_job(shutil.rmtree, self.segment_dir, True)
+
+    async def _async_run(self):
+        delay = RESTART_DELAY_MIN
+        while not self._stopped:
+            await self.hass.async_add_executor_job(make_dirs, self.segment_dir)
+            consumer = await self.ingest_manager.async_acquire(self.camera_entity_id)
+            if not consumer:
+                _LOGGER.warning(f"Pre-record buffer: no stream for {self.camera_entity_id}, retrying in {delay}s")
+            else:
+                started = time.monotonic()
+                try:
+                    await self._async_record(consumer)
+                finally:
+                    consumer.release()
+                if time.monotonic() - started > RESTART_DELAY_MAX:
+                    delay = RESTART_DELAY_MIN
+                _LOGGER.warning(f"Pre-record buffer for {self.camera_entity_id} stopped, restarting in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RESTART_DELAY_MAX)
+
+    async def _async_record(self, consumer):
+        args = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "mpegts", "-i", "pipe:0",
+            "-map", "0:v", "-map", "0:a?", "-c", "copy",
+            "-f", "segment", "-segment_time", str(SEGMENT_TIME), "-segment_format", "mpegts",
+            "-reset_timestamps", "1", "-strftime", "1",
+            os.path.join(self.segment_dir, "%s.ts"),
+        ]
+
+        self._process = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        feed_task = self.hass.async_create_background_task(
+            async_feed_process(consumer, self._process), f"advanced_snapshot.prerecord_feed.{self.camera_entity_id}"
+        )
+        evict_task = self.hass.async_create_background_task(
+            self._async_evict_loop(), f"advanced_snapshot.prerecord_evict.{self.camera_entity_id}"
+        )
+        try:
+            # Only the tail of stderr is kept, it is read line by line
+            last_error = b""
+            while line := await self._process.stderr.readline():
+                last_error = line
+            await self._process.wait()
+            if last_error:
+                _LOGGER.warning(f"Pre-record ffmpeg for {self.camera_entity_id}: {last_error.decode('utf-8', errors='ignore').strip()}")
+        finally:
+            evict_task.cancel()
+            feed_task.cancel()
+            if self._process.returncode is None:
+                self._process.terminate()
+                try:
+                    await asyncio.wait_for(self._process.wait(), 5)
+                except asyncio.TimeoutError:
+                    self._process.kill()
+
+    async def _async_evict_loop(self):
+        while True:
+            await asyncio.sleep(SEGMENT_TIME)
+            await self.hass.async_add_executor_job(self.evict)
+
+    def _list_segments(self):
+        """Return [(start_time, path, size)] sorted by start time, oldest first."""
+        segments = []
+        try:
+            with os.scandir(self.segment_dir) as entries:
+                for entry in entries:
+                    name, ext = os.path.splitext(entry.name)
+                    if ext == ".ts" and name.isdigit():
+                        segments.append((int(name), entry.path, entry.stat().st_size))
+        except FileNotFoundError:
+            pass
+        segments.sort()
+        return segments
+
+    def evict(self):
+        """Delete segments beyond the configured age and size. Blocking."""
+        segments = self._list_segments()
+        if len(segments) < 2:
+            return
+        # The newest segment is still being written and always kept
+        complete = segments[:-1]
+        total_bytes = sum(size for _, _, size in segments)
+        oldest_needed = time.time() - self.seconds - SEGMENT_TIME
+        for index, (_, path, size) in enumerate(complete):
+            end = segments[index + 1][0]
+            if end >= oldest_needed and total_bytes <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def is_healthy(self) -> bool:
+        """Whether ffmpeg runs and is still writing new segments. Blocking."""
+        if not self.running:
+            return False
+        segments = self._list_segments()
+        return bool(segments) and segments[-1][0] >= time.time() - STALL_SECONDS
+
+    async def async_capture(self, pre_seconds: int, duration: int):
+        """Collect the segments covering pre_seconds before now until duration after now.
+
+        Returns (clip_dir, segments, offset, start) where offset is the
+        position of the requested start within the first segment and start
+        the wall-clock time of the first frame of the clip.
+        """
+        clip_start = time.time() - pre_seconds
+        clip_end = clip_start + pre_seconds + duration
+        job_dir = os.path.join(self.clip_dir, uuid.uuid4().hex)
+        await self.hass.async_add_executor_job(make_dirs, job_dir)
+
+        linked = {}
+        deadline = time.monotonic() + pre_seconds + duration + 4 * SEGMENT_TIME + 10
+        while True:
+            segments = await self.hass.async_add_executor_job(self._list_segments)
+            for index, (start, path, _) in enumerate(segments[:-1]):
+                end = segments[index + 1][0]
+                if end <= clip_start or start >= clip_end or path in linked:
+                    continue
+                target = os.path.join(job_dir, os.path.basename(path))
+                try:
+                    await self.hass.async_add_executor_job(os.link, path, target)
+                    linked[path] = (start, target)
+                except FileNotFoundError:
+                    continue
+            # Done once the segment containing clip_end has been completed
+            if segments and segments[-1][0] >= clip_end:
+                break
+            if time.monotonic() > deadline:
+                _LOGGER.warning(f"Pre-record buffer for {self.camera_entity_id} did not deliver all segments in time")
+                break
+            await asyncio.sleep(1)
+
+        parts = sorted(linked.values())
+        if not parts:
+            await self.hass.async_add_executor_job(shutil.rmtree, job_dir, True)
+            return None, [], 0, None
+        offset = max(0, clip_start - parts[0][0])
+        return job_dir, [path for _, path in parts], offset, parts[0][0] + offset
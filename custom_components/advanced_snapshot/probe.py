@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import time
+from homeassistant.core import HomeAssistant
+
+_LOGGER = logging.getLogger(__name__)
+
+PROBE_TIMEOUT = 15
+
+
+class ProbeError(Exception):
+    """Raised when a stream could not be probed."""
+
+
+async def async_probe_stream(source: str, timeout: float = PROBE_TIMEOUT) -> dict:
+    """Run ffprobe without blocking the event loop and return the stream info."""
+    args = ["ffprobe", "-v", "error", "-show_streams", "-of", "json"]
+    if source.startswith("rtsp"):
+        args += ["-rtsp_transport", "tcp"]
+    args.append(source)
+
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        process.kill()
+        await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise ProbeError(f"ffprobe failed (rc={process.returncode}): {stderr.decode('utf-8', errors='ignore')}")
+
+    streams = json.loads(stdout.decode("utf-8")).get("streams", [])
+    video_stream = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if video_stream is None:
+        raise ProbeError("No video stream found")
+    audio_stream = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    return {
+        "width": int(video_stream["width"]),
+        "height": int(video_stream["height"]),
+        "video_codec": video_stream.get("codec_name"),
+        "audio_codec": audio_stream.get("codec_name") if audio_stream else None,
+    }
+
+
+class StreamProbeCache:
+    """Stream metadata keyed by stream source, refreshed in the background.
+
+    Expired entries are still returned while a refresh runs, so callers
+    never wait for a probe when any metadata is known.
+    """
+
+    def __init__(self, hass: HomeAssistant, ttl: float):
+        self.hass = hass
+        self.ttl = ttl
+        self._entries = {}
+        self._pending = {}
+
+    def get(self, source: str):
+        entry = self._entries.get(source)
+        if entry is None:
+            return None
+        probed_at, info = entry
+        if time.monotonic() - probed_at > self.ttl:
+            self.async_refresh(source)
+        return info
+
+    async def async_probe(self, source: str):
+        """Probe now, sharing a probe already running for the same source."""
+        task = self._pending.get(source)
+        if task is None:
+            task = self.async_refresh(source)
+        return await asyncio.shield(task)
+
+    def async_refresh(self, source: str):
+        """Start a background probe of source unless one is already running."""
+        task = self._pending.get(source)
+        if task is None:
+            task = self.hass.async_create_background_task(
+                self._async_probe(source), f"{__name__}.probe"
+            )
+            self._pending[source] = task
+        return task
+
+    async def _async_probe(self, source: str):
+        try:
+            info = await async_probe_stream(source)
+        except (ProbeError, asyncio.TimeoutError, OSError, ValueError, KeyError) as e:
+            _LOGGER.warning(f"Probing stream failed: {str(e)}")
+            return self._entries.get(source, (None, None))[1]
+        finally:
+            self._pending.pop(source, None)
+
+        self._entries[source] = (time.monotonic(), info)
+        return info
+
+    def set(self, source: str, info: dict):
+        """Store stream info that is already known, e.g. probed from another source."""
+        self._entries[source] = (time.monotonic(), info)
+
+    def invalidate(self, source: str = None):
+        if source is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(source, None)
@@ -0,0 +1,289 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from homeassistant.core import HomeAssistant, callback
+
+_LOGGER = logging.getLogger(__name__)
+
+# Collect writes for a few seconds, so they are stat'ed and evicted together
+TRACK_DELAY = 5
+# Enforce max_age even if nothing is written
+AGE_CHECK_INTERVAL = 3600
+# Startup scan: pause after every SCAN_BATCH directory entries
+SCAN_BATCH = 200
+SCAN_PAUSE = 0.05
+EVICT_BATCH = 100
+EVICT_PAUSE = 0.1
+
+
+class RetentionManager:
+    """Keeps the snapshot and backup folders within age, size and file limits.
+
+    Files written by the integration are tracked as they are written; the
+    folders are only scanned once at startup, throttled, to pick up the
+    existing files. Names starting with a dot (temp files, timelapse parts)
+    are never touched. Files are evicted oldest first in small batches.
+    A limit of 0 is disabled. The index is only touched from the event loop.
+    """
+
+    def __init__(self, hass: HomeAssistant, folders: list, max_age: float, max_bytes: int,
+                 max_files_per_camera: int, on_evict=None):
+        self.hass = hass
+        self.on_evict = on_evict
+        self.roots = _distinct_roots(folders)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.max_files_per_camera = max_files_per_camera
+        self.total_bytes = 0
+        self.evicted = 0
+        self._files = {}
+        self._heap = []
+        self._camera_heaps = {}
+        self._camera_counts = {}
+        self._pending = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._files),
+            "bytes": self.total_bytes,
+            "evicted": self.evicted,
+        }
+
+    def start(self):
+        self._task = self.hass.async_create_background_task(
+            self._async_run(), "advanced_snapshot.retention"
+        )
+
+    async def async_stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    @callback
+    def track(self, file_path: str, camera_entity_id: str = None):
+        """Register a file the integration has just written."""
+        if not file_path:
+            return
+        file_path = os.path.abspath(file_path)
+        if not self._is_managed(file_path):
+            return
+        self._pending[file_path] = camera_entity_id or self._pending.get(file_path)
+        self._wakeup.set()
+
+    def _is_managed(self, file_path: str) -> bool:
+        return any(file_path.startswith(root + os.sep) for root in self.roots) \
+            and not any(part.startswith(".") for part in file_path.split(os.sep))
+
+    async def _async_run(self):
+        cameras = {
+            entity_id.split(".", 1)[-1].lower(): entity_id
+            for entity_id in self.hass.states.async_entity_ids("camera")
+        }
+        start = time.monotonic()
+        for root in self.roots:
+            for file_path, mtime, size, camera_entity_id in await self.hass.async_add_executor_job(
+                _scan_folder, root, cameras
+            ):
+                self._add(file_path, mtime, size, camera_entity_id)
+        _LOGGER.info(
+            f"Retention: found {len(self._files)} files ({self.total_bytes // (1024 * 1024)} MB) "
+            f"in {time.monotonic() - start:.1f}s"
+        )
+        self._wakeup.set()
+
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), AGE_CHECK_INTERVAL)
+                await asyncio.sleep(TRACK_DELAY)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            pending, self._pending = self._pending, {}
+            if pending:
+                stats = await self.hass.async_add_executor_job(_stat_files, list(pending))
+                for file_path, stat in stats.items():
+                    if stat is None:
+                        self._forget(file_path)
+                    else:
+                        self._add(file_path, stat[0], stat[1], pending[file_path])
+
+            await self._async_evict()
+
+    def _add(self, file_path: str, mtime: float, size: int, camera_entity_id: str = None):
+        old = self._files.get(file_path)
+        if old:
+            camera_entity_id = camera_entity_id or old[2]
+            self._forget(file_path)
+        self._files[file_path] = (mtime, size, camera_entity_id)
+        self.total_bytes += size
+        heapq.heappush(self._heap, (mtime, file_path))
+        if camera_entity_id:
+            self._camera_counts[camera_entity_id] = self._camera_counts.get(camera_entity_id, 0) + 1
+            heapq.heappush(self._camera_heaps.setdefault(camera_entity_id, []), (mtime, file_path))
+
+    def _forget(self, file_path: str):
+        # Heap entries of forgotten files are dropped lazily in _oldest
+        entry = self._files.pop(file_path, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry[1]
+        if entry[2]:
+            self._camera_counts[entry[2]] -= 1
+
+    def _oldest(self, heap: list):
+        """Oldest tracked entry of heap, dropping entries of forgotten or rewritten files."""
+        while heap:
+            mtime, file_path = heap[0]
+            entry = self._files.get(file_path)
+            if entry is not None and entry[0] == mtime:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    def _compact(self):
+        """Rebuild the heaps when overwritten files have left too many stale entries."""
+        if len(self._heap) > 2 * len(self._files) + 1000:
+            self._heap = [(entry[0], file_path) for file_path, entry in self._files.items()]
+            heapq.heapify(self._heap)
+        for camera_entity_id, heap in self._camera_heaps.items():
+            if len(heap) > 2 * self._camera_counts.get(camera_entity_id, 0) + 1000:
+                heap[:] = [
+                    (entry[0], file_path) for file_path, entry in self._files.items()
+                    if entry[2] == camera_entity_id
+                ]
+                heapq.heapify(heap)
+
+    def _select_victims(self) -> list:
+        victims = []
+
+        def evict(heap):
+            mtime, file_path = heapq.heappop(heap)
+            self._forget(file_path)
+            victims.append((file_path, mtime))
+
+        if self.max_age:
+            cutoff = time.time() - self.max_age
+            while (oldest := self._oldest(self._heap)) and oldest[0] < cutoff:
+                evict(self._heap)
+
+        if self.max_files_per_camera:
+            for camera_entity_id, heap in self._camera_heaps.items():
+                while self._camera_counts.get(camera_entity_id, 0) > self.max_files_per_camera \
+                        and self._oldest(heap):
+                    evict(heap)
+
+        if self.max_bytes:
+            while self.total_bytes > self.max_bytes and self._oldest(self._heap):
+                evict(self._heap)
+
+        self._compact()
+        return victims
+
+    async def _async_evict(self):
+        victims = self._select_victims()
+        if not victims:
+            return
+        _LOGGER.info(f"Retention: evicting {len(victims)} files")
+        for index in range(0, len(victims), EVICT_BATCH):
+            deleted = await self.hass.async_add_executor_job(
+                _delete_files, victims[index:index + EVICT_BATCH], self.roots
+            )
+            self.evicted += len(deleted)
+            if self.on_evict:
+                self.on_evict(deleted)
+            await asyncio.sleep(EVICT_PAUSE)
+
+
+def _distinct_roots(folders: list) -> list:
+    """Absolute folders without the ones nested in another folder."""
+    roots = sorted({os.path.abspath(folder) for folder in folders if folder})
+    return [
+        root for root in roots
+        if not any(root != other and root.startswith(other + os.sep) for other in roots)
+    ]
+
+
+def _camera_for_path(relative_path: str, cameras: dict):
+    """Guess the camera of an existing file from its path, longest camera name first."""
+    relative_path = relative_path.lower()
+    for object_id in sorted(cameras, key=len, reverse=True):
+        if object_id in relative_path:
+            return cameras[object_id]
+    return None
+
+
+def _scan_folder(root: str, cameras: dict) -> list:
+    """List (path, mtime, size, camera) of all files below root, throttled."""
+    files = []
+    count = 0
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        try:
+            iterator = os.scandir(directory)
+        except OSError:
+            continue
+        with iterator:
+            for entry in iterator:
+                if entry.name.startswith("."):
+                    continue
+                count += 1
+                if count % SCAN_BATCH == 0:
+                    time.sleep(SCAN_PAUSE)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                camera_entity_id = _camera_for_path(os.path.relpath(entry.path, root), cameras)
+                files.append((entry.path, stat.st_mtime, stat.st_size, camera_entity_id))
+    return files
+
+
+def _stat_files(paths: list) -> dict:
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats[path] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            stats[path] = None
+    return stats
+
+
+def _delete_files(victims: list, roots: list) -> list:
+    """Delete files that were not rewritten since they were selected, then empty folders."""
+    deleted = []
+    directories = set()
+    for path, mtime in victims:
+        try:
+            if os.stat(path).st_mtime > mtime:
+                continue
+            os.unlink(path)
+            deleted.append(path)
+            directories.add(os.path.dirname(path))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            _LOGGER.warning(f"Retention: could not delete {path}: {str(e)}")
+
+    for directory in sorted(directories, key=len, reverse=True):
+        while directory not in roots and any(directory.startswith(root + os.sep) for root in roots):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+    return deleted
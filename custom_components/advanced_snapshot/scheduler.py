@@ -0,0 +1,152 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+
+_LOGGER = logging.getLogger(__name__)
+
+SIGNAL_SCHEDULER_UPDATED = "advanced_snapshot_scheduler_updated"
+
+PRIORITIES = {"low": 0, "normal": 1, "high": 2}
+
+# libx264 presets from the configured one down to the cheapest
+ENCODER_PRESETS = ["medium", "fast", "faster", "veryfast", "superfast", "ultrafast"]
+
+
+class RecordingQueueFullError(Exception):
+    """Raised when a recording is not admitted because the queue is full."""
+
+
+def default_recording_slots() -> int:
+    """One encode per two cores, at least one."""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class RecordingSlot:
+    def __init__(self, priority: str, wait_time: float, preset: str):
+        self.priority = priority
+        self.wait_time = wait_time
+        self.preset = preset
+
+
+class RecordingScheduler:
+    """Limits how many recordings are encoded at the same time.
+
+    Jobs beyond ``max_running`` wait in a priority queue of at most
+    ``max_queue`` entries; within a priority they start in arrival order.
+    When the queue is full, a new job displaces the latest queued job of
+    a lower priority or is rejected. Jobs that start while the system is
+    over budget get a faster encoder preset. All state is only touched
+    from the event loop.
+    """
+
+    def __init__(self, hass: HomeAssistant, max_running: int, max_queue: int):
+        self.hass = hass
+        self.max_running = max(1, int(max_running))
+        self.max_queue = max(0, int(max_queue))
+        self.running = 0
+        self.rejected = 0
+        self.degraded = 0
+        self.last_wait_time = 0.0
+        self._queue = []
+        self._sequence = itertools.count()
+
+    @property
+    def queue_length(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        return {
+            "max_running": self.max_running,
+            "running": self.running,
+            "queue_length": self.queue_length,
+            "max_queue": self.max_queue,
+            "last_wait_time": round(self.last_wait_time, 3),
+            "rejected": self.rejected,
+            "degraded": self.degraded,
+        }
+
+    @asynccontextmanager
+    async def async_slot(self, priority: str = "normal", preset: str = "medium"):
+        """Wait for a free encode slot and hold it for the duration of the block."""
+        start = time.monotonic()
+        await self._async_acquire(PRIORITIES.get(priority, PRIORITIES["normal"]))
+        wait_time = time.monotonic() - start
+        self.last_wait_time = wait_time
+        slot = RecordingSlot(priority, wait_time, self.degrade_preset(preset))
+        if slot.preset != preset:
+            self.degraded += 1
+            _LOGGER.info(f"System over budget, encoding with preset {slot.preset} instead of {preset}")
+        self._async_update()
+        try:
+            yield slot
+        finally:
+            self._release()
+
+    def degrade_preset(self, preset: str) -> str:
+        """Choose a faster preset the more the system is over budget."""
+        pressure = (self.running + self.queue_length) / self.max_running
+        try:
+            pressure = max(pressure, os.getloadavg()[0] / (os.cpu_count() or 1))
+        except OSError:
+            pass
+        if pressure <= 1 or preset not in ENCODER_PRESETS:
+            return preset
+        # One preset step per half of max_running over the limit
+        steps = math.ceil((pressure - 1) * 2)
+        index = min(ENCODER_PRESETS.index(preset) + steps, len(ENCODER_PRESETS) - 1)
+        return ENCODER_PRESETS[index]
+
+    async def _async_acquire(self, priority: int):
+        if self.running < self.max_running and not self._queue:
+            self.running += 1
+            return
+
+        if len(self._queue) >= self.max_queue:
+            lowest = max(self._queue, default=None)
+            if lowest is None or -lowest[0] >= priority:
+                self.rejected += 1
+                self._async_update()
+                _LOGGER.warning(f"Recording queue is full ({self.max_queue} waiting), rejecting job")
+                raise RecordingQueueFullError("Recording queue is full")
+            self._queue.remove(lowest)
+            heapq.heapify(self._queue)
+            self.rejected += 1
+            lowest[2].set_exception(RecordingQueueFullError("Recording was displaced by a job with higher priority"))
+
+        waiter = self.hass.loop.create_future()
+        entry = (-priority, next(self._sequence), waiter)
+        heapq.heappush(self._queue, entry)
+        self._async_update()
+        try:
+            # The slot is handed over by _release, running is not decremented in between
+            await waiter
+        except asyncio.CancelledError:
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._async_update()
+            elif waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # Cancelled right after the slot was handed over
+                self._release()
+            raise
+
+    def _release(self):
+        while self._queue:
+            _, _, waiter = heapq.heappop(self._queue)
+            if not waiter.done():
+                waiter.set_result(None)
+                self._async_update()
+                return
+        self.running -= 1
+        self._async_update()
+
+    @callback
+    def _async_update(self):
+        async_dispatcher_send(self.hass, SIGNAL_SCHEDULER_UPDATED)
@@ -0,0 +1,117 @@
+import logging
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import UnitOfTime
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from .const import DOMAIN
+from .metrics import SIGNAL_TIMINGS_NEW, SIGNAL_TIMINGS_UPDATED
+from .scheduler import SIGNAL_SCHEDULER_UPDATED
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback):
+    scheduler = hass.data[DOMAIN]["recording_scheduler"]
+    async_add_entities([
+        RecordingSchedulerSensor(entry, scheduler, "recording_queue_length", lambda s: s.queue_length),
+        RecordingSchedulerSensor(entry, scheduler, "running_recordings", lambda s: s.running),
+        RecordingSchedulerSensor(
+            entry, scheduler, "recording_wait_time", lambda s: round(s.last_wait_time, 3),
+            UnitOfTime.SECONDS
+        ),
+    ])
+
+    timing_stats = hass.data[DOMAIN]["timing_stats"]
+
+    @callback
+    def _async_add_timing_sensor(key):
+        camera_entity_id, operation = key
+        async_add_entities([TimingSensor(entry, timing_stats, camera_entity_id, operation)])
+
+    for key in timing_stats.keys:
+        _async_add_timing_sensor(key)
+    entry.async_on_unload(async_dispatcher_connect(hass, SIGNAL_TIMINGS_NEW, _async_add_timing_sensor))
+
+
+class RecordingSchedulerSensor(SensorEntity):
+    """State of the recording scheduler, updated whenever it changes."""
+
+    _attr_has_entity_name = True
+    _attr_should_poll = False
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, entry: ConfigEntry, scheduler, key: str, value_fn, unit: str = None):
+        self._scheduler = scheduler
+        self._value_fn = value_fn
+        self._attr_translation_key = key
+        self._attr_unique_id = f"{entry.entry_id}_{key}"
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_info = {
+            "identifiers": {(DOMAIN, entry.entry_id)},
+            "name": "Advanced Snapshot",
+        }
+
+    @property
+    def native_value(self):
+        return self._value_fn(self._scheduler)
+
+    @property
+    def extra_state_attributes(self):
+        return self._scheduler.stats()
+
+    async def async_added_to_hass(self):
+        self.async_on_remove(
+            async_dispatcher_connect(self.hass, SIGNAL_SCHEDULER_UPDATED, self._async_update)
+        )
+
+    @callback
+    def _async_update(self):
+        self.async_write_ha_state()
+
+
+class TimingSensor(SensorEntity):
+    """p95 duration of snapshots or videos of one camera, stage statistics as attributes."""
+
+    _attr_has_entity_name = True
+    _attr_should_poll = False
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_native_unit_of_measurement = UnitOfTime.SECONDS
+
+    def __init__(self, entry: ConfigEntry, timing_stats, camera_entity_id: str, operation: str):
+        self._timing_stats = timing_stats
+        self._camera_entity_id = camera_entity_id
+        self._operation = operation
+        object_id = camera_entity_id.split(".", 1)[-1]
+        self._attr_translation_key = f"{operation}_timing"
+        self._attr_translation_placeholders = {"camera": object_id}
+        self._attr_unique_id = f"{entry.entry_id}_{operation}_timing_{object_id}"
+        self._attr_device_info = {
+            "identifiers": {(DOMAIN, entry.entry_id)},
+            "name": "Advanced Snapshot",
+        }
+
+    @property
+    def native_value(self):
+        total = self._timing_stats.summary(self._camera_entity_id, self._operation).get("total")
+        return round(total["p95"], 3) if total else None
+
+    @property
+    def extra_state_attributes(self):
+        attributes = {"camera_entity_id": self._camera_entity_id}
+        for stage, stats in self._timing_stats.summary(self._camera_entity_id, self._operation).items():
+            for name in ("p50", "p95", "max"):
+                attributes[f"{stage}_{name}"] = round(stats[name], 4)
+            if stage == "total":
+                attributes["samples"] = stats["count"]
+        return attributes
+
+    async def async_added_to_hass(self):
+        self.async_on_remove(async_dispatcher_connect(
+            self.hass, f"{SIGNAL_TIMINGS_UPDATED}_{self._camera_entity_id}_{self._operation}", self._async_update
+        ))
+
+    @callback
+    def _async_update(self):
+        self.async_write_ha_state()
@@ -0,0 +1,170 @@
+import os
+import logging
+import tempfile
+import time
+from io import BytesIO
+from PIL import Image
+
+_LOGGER = logging.getLogger(__name__)
+
+FORMAT_MAP = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+
+_known_dirs = set()
+
+
+def _file_mode() -> int:
+    """Mode a plain open() would give new files.
+
+    mkstemp always creates 0600. The umask is read from /proc instead of
+    os.umask(), which would change it for every thread of the process.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return 0o666 & ~int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    return 0o644
+
+
+_FILE_MODE = _file_mode()
+
+
+def image_format_for(file_path: str) -> str:
+    ext = os.path.splitext(file_path)[1].lower()
+    return FORMAT_MAP.get(ext, "JPEG")
+
+
+def encoder_params(image_format: str, quality=None, optimize=False, progressive=False) -> dict:
+    """Translate the per-call encoder settings into PIL save() arguments.
+
+    PNG is lossless, so quality does not apply; optimize selects the
+    strongest compression. For WebP, optimize selects the slowest and
+    best compression method.
+    """
+    params = {}
+    if image_format == "JPEG":
+        if quality is not None:
+            params["quality"] = quality
+        if optimize:
+            params["optimize"] = True
+        if progressive:
+            params["progressive"] = True
+    elif image_format == "PNG":
+        if optimize:
+            params["optimize"] = True
+    elif image_format == "WEBP":
+        if quality is not None:
+            params["quality"] = quality
+        if optimize:
+            params["method"] = 6
+    return params
+
+
+def ensure_dir(directory: str):
+    """Create a directory once; later calls for the same path are free."""
+    if not directory or directory in _known_dirs:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _known_dirs.add(directory)
+
+
+def make_dirs(directory: str):
+    """Create a directory without caching, for folders that are removed again."""
+    os.makedirs(directory, exist_ok=True)
+
+
+def write_concat_list(list_path: str, paths: list) -> str:
+    """Write an input list for ffmpeg's concat demuxer. Blocking."""
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return list_path
+
+
+def atomic_write(file_path: str, write_func, fsync: bool = False, timer=None):
+    """Write a file through write_func(fileobj) into a temp file and rename it.
+
+    The temp file lives in the target directory, so readers only ever see
+    the old or the complete new file. With a StageTimer, write_func is
+    timed as "encode" and the file handling as "write".
+    """
+    start = time.perf_counter()
+    directory = os.path.dirname(file_path)
+    ensure_dir(directory)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    except FileNotFoundError:
+        # Directory was removed since it was cached
+        _known_dirs.discard(directory)
+        ensure_dir(directory)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            encode_start = time.perf_counter()
+            write_func(f)
+            encode_time = time.perf_counter() - encode_start
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp_path, _FILE_MODE)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if fsync:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    if timer:
+        timer.add("encode", encode_time)
+        timer.add("write", time.perf_counter() - start - encode_time)
+
+
+def _prepare(img: Image.Image, image_format: str, encoder: dict = None):
+    encoder = encoder or {}
+    params = encoder_params(image_format, encoder.get("quality"), encoder.get("optimize"), encoder.get("progressive"))
+    if image_format == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+        img = img.convert("RGB")
+    return img, params
+
+
+def save_image(img: Image.Image, file_path: str, encoder: dict = None, fsync: bool = False, timer=None,
+               image_format: str = None):
+    """Encode img straight into file_path. Blocking, call from a worker thread."""
+    image_format = image_format or image_format_for(file_path)
+    img, params = _prepare(img, image_format, encoder)
+
+    atomic_write(file_path, lambda f: img.save(f, format=image_format, **params), fsync, timer)
+
+    _LOGGER.info(f"Snapshot saved: {file_path} ({image_format})")
+
+
+def encode_image(img: Image.Image, image_format: str, encoder: dict = None, timer=None) -> bytes:
+    """Encode img into memory. Blocking, call from a worker thread."""
+    start = time.perf_counter()
+    img, params = _prepare(img, image_format, encoder)
+    buffer = BytesIO()
+    img.save(buffer, format=image_format, **params)
+    if timer:
+        timer.add("encode", time.perf_counter() - start)
+    return buffer.getvalue()
+
+
+def write_bytes(data: bytes, file_path: str, fsync: bool = False, timer=None):
+    start = time.perf_counter()
+    atomic_write(file_path, lambda f: f.write(data), fsync)
+    if timer:
+        timer.add("write", time.perf_counter() - start)
+
+    _LOGGER.info(f"Snapshot saved: {file_path} ({len(data)} bytes)")
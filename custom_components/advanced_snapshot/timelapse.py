@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import time
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from .ffmpeg_process import FFmpegProcess
+from .storage import make_dirs, write_concat_list
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY = "advanced_snapshot.timelapse"
+STORAGE_VERSION = 1
+
+
+class TimelapseSession:
+    """Captures a frame every ``interval`` seconds and pipes it into ffmpeg.
+
+    Frames go as rgb24 straight into the stdin of a long-running ffmpeg,
+    at most one frame is held in memory. Every run of ffmpeg writes a
+    fragmented MP4 part next to the target file, so a part stays readable
+    even if Home Assistant stops unexpectedly. After a restart the session
+    continues with a new part; when it ends, the parts are joined into
+    ``file_path`` without re-encoding.
+
+    ``config`` is the persisted state: camera_entity_id, file_path,
+    interval, fps, end_time, data (the service options), size, parts and
+    frames.
+    """
+
+    def __init__(self, manager, session_id: str, config: dict):
+        self.manager = manager
+        self.hass = manager.hass
+        self.session_id = session_id
+        self.config = config
+        self._task = None
+        self._stop = asyncio.Event()
+        self._finish = True
+        self._frame = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def status(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "camera_entity_id": self.config["camera_entity_id"],
+            "file_path": self.config["file_path"],
+            "frames": self.config["frames"],
+            "parts": len(self.config["parts"]),
+            "resolution": self.config["size"],
+            "end_time": self.config["end_time"],
+            "running": self.running,
+        }
+
+    def start(self):
+        self._stop.clear()
+        self._finish = True
+        self._task = self.hass.async_create_background_task(
+            self._async_run(), f"advanced_snapshot.timelapse.{self.session_id}"
+        )
+
+    async def async_stop(self, finish: bool = True):
+        """Stop capturing; with finish the parts are joined, otherwise the session is kept for resuming."""
+        self._finish = finish
+        self._stop.set()
+        if self._task:
+            await asyncio.shield(self._task)
+
+    async def _async_run(self):
+        if not self.config["size"]:
+            # The first frame decides the video size
+            while self._frame is None and not self._stop.is_set() and time.time() < self.config["end_time"]:
+                self._frame = await self._async_capture()
+                if self._frame is None:
+                    await self._async_sleep(self.config["interval"])
+            if self._frame is not None:
+                self.config["size"] = list(self._frame[0])
+
+        if self.config["size"] and not self._stop.is_set() and time.time() < self.config["end_time"]:
+            await self._async_record_part()
+
+        if self._finish or time.time() >= self.config["end_time"]:
+            await self._async_finish()
+
+    async def _async_record_part(self):
+        directory, name = os.path.split(self.config["file_path"])
+        part_path = os.path.join(directory, f".{name}.part{len(self.config['parts'])}.mp4")
+        self.config["parts"].append(part_path)
+        await self.manager.async_save()
+        await self.hass.async_add_executor_job(make_dirs, directory)
+
+        width, height = self.config["size"]
+        fps = self.config["fps"]
+        args = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-framerate", str(fps),
+            "-i", "pipe:0",
+            # yuv420p needs even dimensions
+            "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+            "-c:v", "libx264", "-preset", "medium", "-crf", "23", "-pix_fmt", "yuv420p", "-g", str(fps),
+            "-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+            "-f", "mp4", "-y", part_path,
+        ]
+        process = FFmpegProcess(self.hass, args, feeder=self._async_feed)
+        try:
+            await process.async_run()
+        except OSError as e:
+            _LOGGER.error(f"Timelapse {self.session_id}: ffmpeg could not be started: {str(e)}")
+            return
+        if process.returncode != 0:
+            _LOGGER.error(f"Timelapse {self.session_id}: ffmpeg failed (rc={process.returncode}): {process.stderr}")
+        await self.manager.async_save()
+
+    async def _async_feed(self, process):
+        interval = self.config["interval"]
+        next_capture = time.monotonic()
+        try:
+            while not self._stop.is_set() and time.time() < self.config["end_time"]:
+                frame, self._frame = self._frame, None
+                if frame is None:
+                    frame = await self._async_capture()
+                if frame is not None:
+                    process.stdin.write(frame[1])
+                    del frame
+                    # Waits while ffmpeg is busy, so frames never pile up in memory
+                    await process.stdin.drain()
+                    self.config["frames"] += 1
+
+                next_capture += interval
+                now = time.monotonic()
+                if next_capture < now:
+                    # Capturing took longer than the interval, skip the missed frames
+                    next_capture += (now - next_capture) // interval * interval + interval
+                await self._async_sleep(min(next_capture - now, self.config["end_time"] - time.time()))
+        except (BrokenPipeError, ConnectionResetError):
+            _LOGGER.warning(f"Timelapse {self.session_id}: ffmpeg closed its input")
+        finally:
+            if not process.stdin.is_closing():
+                process.stdin.close()
+
+    async def _async_capture(self):
+        try:
+            return await self.manager.capture_frame(self.config["data"], self.config["size"])
+        except Exception as e:
+            _LOGGER.warning(f"Timelapse {self.session_id}: capturing a frame failed: {str(e)}")
+            return None
+
+    async def _async_sleep(self, seconds: float):
+        if seconds <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _async_finish(self):
+        file_path = self.config["file_path"]
+        parts = await self.hass.async_add_executor_job(_existing_parts, self.config["parts"])
+        error = None
+        if not parts:
+            error = "No frames were recorded"
+        elif len(parts) == 1:
+            await self.hass.async_add_executor_job(os.replace, parts[0], file_path)
+        else:
+            list_path = f"{parts[0]}.txt"
+            await self.hass.async_add_executor_job(write_concat_list, list_path, parts)
+            process = FFmpegProcess(self.hass, [
+                "ffmpeg", "-hide_banner", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", list_path,
+                "-c", "copy", "-movflags", "+faststart", "-f", "mp4", "-y", file_path,
+            ])
+            try:
+                await process.async_run()
+                if process.returncode != 0:
+                    error = f"Joining the parts failed (rc={process.returncode}): {process.stderr}"
+            except OSError as e:
+                error = f"Joining the parts failed: {str(e)}"
+            if not error:
+                await self.hass.async_add_executor_job(_remove_files, [*parts, list_path])
+
+        if error:
+            _LOGGER.error(f"Timelapse {self.session_id}: {error}")
+        else:
+            _LOGGER.info(f"Timelapse {self.session_id} saved at {file_path} ({self.config['frames']} frames)")
+        await self.manager.async_remove(self)
+        self.hass.bus.async_fire("advanced_snapshot_timelapse_finished", {
+            **self.status(),
+            "running": False,
+            "success": error is None,
+            "error": error,
+        })
+
+
+class TimelapseManager:
+    """Keeps the timelapse sessions and their state in a Store across restarts."""
+
+    def __init__(self, hass: HomeAssistant, capture_frame):
+        self.hass = hass
+        self.capture_frame = capture_frame
+        self.sessions = {}
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+
+    async def async_load(self):
+        data = await self._store.async_load() or {}
+        for session_id, config in data.get("sessions", {}).items():
+            self.sessions[session_id] = TimelapseSession(self, session_id, config)
+
+    def resume(self):
+        for session in self.sessions.values():
+            if not session.running:
+                _LOGGER.info(f"Resuming timelapse {session.session_id}")
+                session.start()
+
+    async def async_start(self, session_id: str, config: dict) -> TimelapseSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = TimelapseSession(self, session_id, config)
+            await self.async_save()
+        if not session.running:
+            session.start()
+        return session
+
+    async def async_remove(self, session: TimelapseSession):
+        if self.sessions.get(session.session_id) is session:
+            del self.sessions[session.session_id]
+            await self.async_save()
+
+    async def async_save(self):
+        await self._store.async_save({
+            "sessions": {session_id: session.config for session_id, session in self.sessions.items()}
+        })
+
+    async def async_stop(self):
+        """Stop all sessions so that they resume on the next start."""
+        await asyncio.gather(*(
+            session.async_stop(finish=False) for session in list(self.sessions.values())
+        ))
+
+
+def _existing_parts(parts: list) -> list:
+    return [path for path in parts if os.path.isfile(path) and os.path.getsize(path) > 0]
+
+
+def _remove_files(paths: list):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass